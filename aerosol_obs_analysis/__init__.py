@@ -1,12 +1,34 @@
-import sys
-sys.path.append('aerosol_obs_analysis')
+'''''
 
-from aeronet_analysis import aeronet
-from aeronet_single_site import aeronet_single_site
+aerosol_obs_analysis
 
-from aeronet_plot import plot_aeronet
+  aeronet, aeronet_single_site, analysis_utils : imported with the package
+  profiler, profiling : stage profiling (aeronet_profile)
+  plot_aeronet, plot_single_site, plot_single_site_size : imported on first use,
+    so the analysis core does not load matplotlib or plotly
 
-from single_site_plot import plot_single_site
-from single_site_size_plot import plot_single_site_size
+The modules import each other relatively; the scripts are run as
+modules of the package, e.g. python -m aerosol_obs_analysis.aeronet_pipeline
 
-import analysis_utils
+'''''
+from .aeronet_analysis import aeronet
+from .aeronet_single_site import aeronet_single_site
+from .aeronet_profile import profiler, profiling
+
+from . import analysis_utils
+
+# Plotting classes: name -> module
+lazy_imports = {'plot_aeronet'         : 'aeronet_plot',
+                'plot_single_site'     : 'single_site_plot',
+                'plot_single_site_size': 'single_site_size_plot'}
+
+def __getattr__(name):
+  if name in lazy_imports:
+    import importlib
+    value = getattr(importlib.import_module('.'+lazy_imports[name],__name__),name)
+    globals()[name] = value
+    return value
+  raise AttributeError('module {} has no attribute {}'.format(__name__,name))
+
+def __dir__():
+  return sorted(list(globals()) + list(lazy_imports))
@@ -0,0 +1,134 @@
+'''''
+
+Grouped aggregation of AERONET data
+
+The rows are sorted by group once (class grouping); each reduce() then
+computes the requested statistics for all its columns with NumPy
+reduceat, without building per-group lists or running one groupby per
+statistic.
+
+class grouping
+methods:
+  - __init__(keys,mask)     : keys (e.g. df['AERONET_Site_Name']), mask of rows to include
+  - size   ()               : return array of the rows per group
+  - reduce (values,stats)   : return {stat: array (groups x columns)}
+    - values: 2-D array (rows x columns), NaN skipped like pandas
+
+functions:
+  - group_stats(df,spec,by,mask,dropna) : return df_stats
+    - spec: {column: stat or list of stats}, as DataFrame.agg, columns (column, stat)
+    - dropna=True drops rows with NaN in any column of spec (as df.dropna())
+
+stats: 'count','sum','mean','std','min','max','median' and percentiles 'p5','p95',...
+Groups with no valid value give NaN (count 0).
+
+'''''
+import numpy as np
+import pandas as pd
+
+site_col = 'AERONET_Site_Name'
+
+def percentile_of(stat):
+  if stat == 'median':
+    return 50.
+  if stat[0] == 'p' and stat[1:].replace('.','',1).isdigit():
+    return float(stat[1:])
+  return None
+
+class grouping():
+
+  def __init__(self,keys,mask=None):
+    codes, labels = pd.factorize(keys, sort=True)
+    keep = codes >= 0
+    if mask is not None:
+      keep &= np.asarray(mask)
+
+    rows = np.flatnonzero(keep)
+    self.order = rows[np.argsort(codes[rows], kind='stable')]
+    codes = codes[self.order]
+    self.starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.zeros(0,dtype=int)
+    self.ends = np.r_[self.starts[1:], len(codes)].astype(int)
+    # Group of each sorted row, 0..n_groups-1
+    self.group = np.repeat(np.arange(len(self.starts)), self.ends-self.starts)
+
+    self.labels = pd.Index(np.asarray(labels)[codes[self.starts]], name=getattr(keys,'name',None))
+
+  def size(self):
+    return self.ends-self.starts
+
+  def reduce(self,values,stats=['mean']):
+    values = np.asarray(values)
+    if values.ndim == 1:
+      values = values[:,None]
+    n_groups, n_cols = len(self.starts), values.shape[1]
+    if n_groups == 0:
+      return {stat: np.zeros((0,n_cols)) for stat in stats}
+
+    v = values[self.order].astype(np.float64)
+    finite = ~np.isnan(v)
+    result = {}
+
+    count = np.add.reduceat(finite, self.starts, axis=0, dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      if {'sum','mean','std'} & set(stats):
+        total = np.add.reduceat(np.where(finite,v,0), self.starts, axis=0)
+        mean  = total/count
+      if 'std' in stats:
+        # Two-pass variance, ddof=1 as pandas
+        dev = np.where(finite, v-mean[self.group], 0)
+        result['std'] = np.sqrt(np.add.reduceat(dev**2, self.starts, axis=0)/(count-1))
+        result['std'][count < 2] = np.nan
+
+    for stat in stats:
+      if stat == 'count':
+        result[stat] = count
+      elif stat == 'sum':
+        result[stat] = total
+      elif stat == 'mean':
+        result[stat] = mean
+      elif stat == 'min':
+        result[stat] = np.fmin.reduceat(v, self.starts, axis=0)
+      elif stat == 'max':
+        result[stat] = np.fmax.reduceat(v, self.starts, axis=0)
+      elif percentile_of(stat) is not None:
+        result[stat] = self.percentile(v, count, percentile_of(stat))
+      elif stat != 'std':
+        raise ValueError('Unknown statistic: {}'.format(stat))
+
+    return result
+
+  def percentile(self,v,count,q):
+    # Linear interpolation between the sorted values of each group (NaN sorted last)
+    result = np.full(count.shape, np.nan)
+    for j in range(v.shape[1]):
+      x = v[np.lexsort((v[:,j], self.group)), j]
+      pos = (count[:,j]-1)*q/100
+      lo, hi = np.floor(pos).astype(int), np.ceil(pos).astype(int)
+      valid = count[:,j] > 0
+      x_lo = x[(self.starts+lo)[valid]]
+      x_hi = x[(self.starts+hi)[valid]]
+      result[valid,j] = x_lo + (x_hi-x_lo)*(pos-lo)[valid]
+    return result
+
+def group_stats(df,spec,by=site_col,mask=None,dropna=False):
+  spec = {c: [s] if isinstance(s,str) else list(s) for c,s in spec.items()}
+  if dropna:
+    valid = df[list(spec)].notna().all(axis=1).values
+    mask = valid if mask is None else valid & np.asarray(mask)
+
+  g = grouping(df[by], mask)
+
+  # Columns with the same statistics are reduced together
+  stat_sets = {}
+  for c, stats in spec.items():
+    stat_sets.setdefault(tuple(stats),[]).append(c)
+
+  result = {}
+  for stats, columns in stat_sets.items():
+    reduced = g.reduce(df[columns].to_numpy(dtype=np.float64), list(stats))
+    for i, c in enumerate(columns):
+      for stat in stats:
+        result[(c,stat)] = reduced[stat][:,i]
+
+  df_stats = pd.DataFrame(result, index=g.labels)
+  return df_stats[[(c,stat) for c, stats in spec.items() for stat in stats]]
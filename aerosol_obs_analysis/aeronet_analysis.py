@@ -5,32 +5,121 @@ AERONET analysis tool for Level 2.0 Daily
 class aeronet
 methods:
   - __init__(time_range, aod_var_names, pickle_path, pickle_name,
-             from_pickle, save_pickle, start_with_guide)
+             from_pickle, save_pickle, start_with_guide, cache_mb)
+    - cache_mb: memory budget of the result cache (0 to disable)
   - analysis_guide()
+    - Prompts for the options of aeronet_pipeline (load, skim, combine, filters, save)
 
   - load_pickle           (pickle_name,pickle_path)       : self.df 
   - load_pickle_all       (data_name,pickle_name_default) : return df
+  - load_store            (store_name,columns,time_range,sites,store_path) : self.df
+    - .parquet/.feather/.pkl, reading only the requested columns, dates and sites
+    - .mmap (aeronet_mmap) is opened, not read: self.df is materialized on first use as a
+      read-only view of the memory-mapped arrays, shared by all processes opening the store,
+      and site_data() reads the site's rows from the store without materializing self.df
+  - migrate_pickles       (pickle_names,fmt)              : return list_of_store_names
   - extract_daily_from_raw(data_name)                     : return df
     - data_name: 'AOD' or 'INV'
-
+  - read_daily_files      (file_path,n_workers)           : return df
+    - Non-interactive, n_workers > 1 parses the site files in a process pool
+    - Measurements are read as float32 with -999 as NaN, site names as category (analysis_utils.ingest_dtypes)
+  - read_daily_tar        (tar_name,member_path,n_workers): return df
+    - Same as read_daily_files, streaming the files from a .tar(.gz) archive
+      (with a pool, at most 2 files per worker are read ahead of the parsing)
+
+  - extract_daily_chunked(data_name,file_path,store_name,max_memory_mb,
+                          time_range,columns,min_rec,n_workers) : return df_ave
+    - Out-of-core: reads, skims, filters and averages the site files in batches
+      of about max_memory_mb, appending the rows to store_name (.parquet), see aeronet_chunked
+    - store_name defaults to the all-sites store, or AOD20/INV20_daily_chunked_<start>_<end>.parquet
+      with a time_range (time-filtered rows are never written to the all-sites store)
+    - columns as cal_average, default 'SIZE' for INV and ['AOD_500nm'] for AOD
+
+  - update_daily(data_name,file_path,store_name,n_workers) : return df, list_of_updated_sites
+    - Incremental: parses only the new/changed site files (only the appended rows of
+      files that grew) and merges them into the store, see aeronet_update
+  - update_average(df_ave,sites,columns,min_rec) : return df_ave
+    - Recomputes cal_average for the updated sites only
+
+  - skim_daily(df,data_name): return df_new
   - skim_inv(df): return df_new ()
     - df: DataFrame of raw inv data
+    - Wavelength pairs (440/443, 675/667, 870/865nm) are coalesced in one block
 
-  - combine_df(): return df
-    - Combine df_aod_all and df_inv_all
+  - combine_df(method): return df
+    - Combine df_aod_all and df_inv_all (outer join), rows sorted by site and date
+    - method='keyed' joins on integer (site, date) keys (aeronet_index.join_site_date),
+      Day_of_Year and lat/lon from AOD (INV for the dates without AOD)
+    - method='merge' is pd.merge on columns_to_keep, also used if (site, date) is not unique
 
+  - site_index  ()                : return site_date_index of self.df (built once)
+  - site_data   (site,time_range) : return df_result
   - filter_time (df,time_range)   : return df_result
-  - filter_site (df)              : return df_result, site_name
+  - filter_site (df,site_name)    : return df_result, site_name (asks if site_name is None)
+    - KeyError if site_name is given and has no data
+    - Both use site_index() when df is self.df
   - filter_rec  (df,min_rec)      : return df_result
-  - cal_average (columns,min_rec) : return df_ave
+  - cal_average (columns,min_rec,stats,sites) : return df_ave
+    - columns='SIZE' averages the size bins (cal_size_average)
+    - stats: extra statistics of columns, e.g. ['std','min','max','p90'] -> 'AOD_500nm_std', ...
+    - One grouped pass (aeronet_aggregate.group_stats), Record_number is the count per site
   - select_sites  (lat,lon)       : return list_of_site_names
+    - lon[0] > lon[1] selects across the dateline, e.g. lon=[170,-170]
+  - select_sites_radius(lat,lon,radius_km) : return list_of_site_names
+  - nearest_sites (lat,lon,k)     : return list_of_site_names
+  - site_locator  ()              : return spatial index of the sites (built once)
+
+  - monthly_cube     (columns)    : return site x month count/mean/std cube of self.df (built once)
+    - Rebuilt when columns are not all in the cube, keeping the columns it had
+    - Used by aeronet_single_site, see aeronet_climatology
+  - save_monthly_cube(store_name) : save the cube next to store_name in pickle_path
+  - load_monthly_cube(store_name) : read the cube saved by save_monthly_cube
+
+  - daily_series(columns,sites,time_range) : return (site x day) arrays of columns on a daily calendar
+    - Gap masks, rolling statistics and anomalies for all sites at once, see aeronet_timeseries
+
+  - collocate(field,var,method,time_match) : return df of obs/model pairs of each site and date
+    - field: aeronet_collocation.model_field (time, lat, lon), nearest or bilinear,
+      statistics by aeronet_collocation.pair_stats(pairs,by)
+
+  - grid_cube(columns,grid,time,site_mean,time_range) : return lat/lon grid cube of count/mean/std of columns
+    - grid: grid_deg (e.g. 1, 2.5) or the lat/lon of a model grid, time: 'month' slices or None,
+      field(var,stat) arrays and save() to .npz/.nc, see aeronet_grid
+
+  - cached     (name,args,func)   : return func(), kept in the cache by name, args and df version
+  - cache_stats()                 : return dict of cache hits, misses, evictions, entries, size_mb
+    - Results of cal_average, select_sites*, nearest_sites and
+      aeronet_single_site.monthly_average, daily_series and grid_cube are cached (LRU within cache_mb, aeronet_cache)
+      and dropped when self.df is reassigned
+
+  The loading, skimming, combining, filtering, averaging and site selection
+  methods are recorded by aeronet_profile.profiler when it is enabled
+
+functions:
+  - site_average(df,columns,min_rec,stats,mask) : return df_ave of any df (cal_average of self.df)
+  - size_average(df,min_rec,mask)               : return df_ave of the size bins (cal_size_average)
 
 '''''
 import numpy as np
 import pandas as pd
 import os
 import datetime
-from analysis_utils import *
+import tarfile
+from .analysis_utils import *
+from .aeronet_store import save_df, read_df, read_columns, store_name, store_format, migrate_pickle
+from .aeronet_mmap import mmap_store
+from .aeronet_size_analysis import bin_names # Registers df.dvdlnr
+from .aeronet_index import site_date_index, join_site_date
+from .aeronet_spatial import site_locator
+from .aeronet_aggregate import grouping, group_stats
+from .aeronet_update import manifest_name, load_manifest, save_manifest, scan_files, plan_update
+from .aeronet_chunked import plan_batches, parquet_appender
+from .aeronet_climatology import monthly_cube, read_cube, cube_name
+from .aeronet_timeseries import daily_series
+from .aeronet_collocation import collocation
+from .aeronet_grid import grid_cube
+from .aeronet_cache import result_cache, result_key, memoize
+from .aeronet_profile import profiled
 
 # Constants
 month_day = {1:31, 2:28, 3:31,  4:30,  5:31,  6:30,
@@ -77,6 +166,11 @@ pickle_inv_ave_name = 'INV20_size_ave_{}.pkl'.format(time_range_str)
 # Combined
 pickle_name = 'COM20_{}.pkl'.format(time_range_str)
 
+# Columnar store (see aeronet_store), replacing the pickles above
+store_fmt = 'parquet'
+store_aod_all_name = store_name(pickle_aod_all_name,store_fmt)
+store_inv_all_name = store_name(pickle_inv_all_name,store_fmt)
+
 # Columns
 columns_to_keep=['AERONET_Site_Name', 'Date(dd:mm:yyyy)',
                   'Day_of_Year',
@@ -115,9 +209,57 @@ input_def = lambda question,def_value: input('{} {}({}): '.format(question,enter
 
 # For print
 saved_as = lambda dname,fname: '\nSaved {} as {} \n************'.format(dname,fname)
+
+def print_memory(df):
+  mem, mem_default = memory_footprint(df)
+  print('\nMemory usage: {:.1f} MB (estimated without ingest schema: {:.1f} MB)'.format(mem/1e6,mem_default/1e6))
+## Site averages of a DataFrame (aeronet.cal_average, and each batch of extract_daily_chunked)
+def site_average(df,columns=['AOD_500nm'],min_rec=0,stats=[],mask=None):
+  if type(columns)==str and columns.upper() == 'SIZE':
+    return size_average(df,min_rec,mask)
+
+  # Records with all columns, as df.dropna()
+  spec = {c:'mean' for c in columns_def[2:]}
+  spec.update({c:['mean','count']+list(stats) for c in columns})
+  valid = df['Day_of_Year'].notna().values
+  df_stats = group_stats(df,spec,mask=valid if mask is None else valid & mask,dropna=True)
+
+  df_ave = df_stats.xs('mean',axis=1,level=1).copy()
+  for stat in stats:
+    for c in columns:
+      df_ave[f'{c}_{stat}'] = df_stats[(c,stat)]
+  df_ave['Record_number'] = df_stats[(columns[0],'count')]
+  if min_rec>0:
+    df_ave = df_ave[df_ave['Record_number']>= min_rec]
+
+  return df_ave
+
+def size_average(df,min_rec=0,mask=None):
+  # Same as site_average(bin_names), the bins are averaged from df.dvdlnr
+  dv = df.dvdlnr.values
+  valid = ~np.isnan(dv).any(axis=1) & df[columns_def].notna().all(axis=1).values
+  g = grouping(df['AERONET_Site_Name'],mask=valid if mask is None else valid & mask)
+  means = g.reduce(np.hstack([df[columns_def[2:]].to_numpy(dtype=float),dv]),['mean'])['mean']
+
+  df_ave = pd.DataFrame(means,index=g.labels,columns=columns_def[2:]+bin_names)
+  df_ave['Record_number'] = g.size()
+  if min_rec>0:
+    df_ave = df_ave[df_ave['Record_number']>= min_rec]
+
+  return df_ave
+
 ###################
 class aeronet():
 
+  _df = None
+  _store = None
+  _store_view = None
+  _site_index = None
+  _site_locator = None
+  _monthly_cube = None
+  _df_version = 0
+  cache = None
+
   def __init__(self,time_range = time_range,
                     aod_var_names = aod_var_names,
                     pickle_path = pickle_path,
@@ -125,9 +267,11 @@ class aeronet():
                     col_names = col_names,
                     from_pickle = False, # AOD and size combined
                     save_pickle=False,
-                    start_with_guide=False):
+                    start_with_guide=False,
+                    cache_mb=256):
 
     self.time_range     = time_range
+    self.cache = result_cache(cache_mb) if cache_mb else None
 
     # Pickle names
     self.pickle_path  = pickle_path
@@ -141,49 +285,59 @@ class aeronet():
 
     if from_pickle:
       print('Loading AERONET data from pickle: {}'.format(pickle_name))
-      self.df = pd.read_pickle(self.pickle_path+self.pickle_name)
+      self.df = read_df(self.pickle_path+self.pickle_name)
     elif start_with_guide:
       self.analysis_guide()
     else:
       print('AERONET data object created. Use .read_pickle() to load data from pickle, or .analysis_guide() to read raw data.')
       
 
+  ## Data, reassigning it drops the site/date and spatial indexes, the monthly cube
+  ## and the cached results
+  @property
+  def df(self):
+    if self._df is None and self._store is not None:
+      # Opened .mmap store, materialized on first use (views of the mapped arrays)
+      self._df = self._store.frame(**self._store_view)
+    return self._df
+
+  @df.setter
+  def df(self,df):
+    self._df = df
+    self._store = None
+    self._site_index = None
+    self._site_locator = None
+    self._monthly_cube = None
+    self._df_version += 1
+    if self.cache:
+      self.cache.clear()
+
   ## Guide to load and do data analysis
+  # Asks for the options, then runs aeronet_pipeline with them
   def analysis_guide(self):
+    from .aeronet_pipeline import aeronet_pipeline
 
     print('\n##### Analysis from raw/half-processed data #####')
-
-    ## AOD
-    aod_from_pickle = input_yes('Load AOD data (all records) from pickle?')
-
-    if aod_from_pickle: # Load from pickle
-      try: 
-        self.df_aod_all = self.load_pickle_all('AOD',pickle_aod_all_name)
-      except:
-        print('\nError in loading pickle. Check file name and path.')
-        return
-        
-    else: # Load from dat
-      self.df_aod_all = self.extract_daily_from_raw('AOD')
-
-    ## Size from inversion product
-    inv_from_pickle = input_yes('Load INV df (all records) from pickle?')
-
-    if inv_from_pickle: # Load from pickle
-      self.df_inv_all = self.load_pickle_all('INV',pickle_inv_all_name)
-    else:
-      self.df_inv_all = self.extract_daily_from_raw('INV')
+    config = {'pickle_path': self.pickle_path}
+
+    ## AOD and size from inversion product
+    for data_name, pickle_name_default in [('AOD',pickle_aod_all_name),('INV',pickle_inv_all_name)]:
+      from_pickle = input_yes('Load {} data (all records) from pickle?'.format(data_name))
+      if from_pickle:
+        if os.path.exists(self.pickle_path+store_name(pickle_name_default,store_fmt)):
+          pickle_name_default = store_name(pickle_name_default,store_fmt)
+        config[data_name.lower()] = {'file': input_def('Pickle name?', pickle_name_default)}
+      else: # Load from dat
+        config[data_name.lower()] = self.raw_source_guide(data_name,config)
 
     # Combine df
-    combine = input_yes('Combine AOD and INV df?')
-    if combine:
-      self.df = self.combine_df()
+    config['combine'] = input_yes('Combine AOD and INV df?')
 
     ## Filter time period
     extract = input_yes('Filter time range?')
     if extract:
       print(f'Time range: {self.time_range}')
-      self.df = self.filter_time(self.df,self.time_range)
+      config['time_range'] = self.time_range
       time_range_str = '_'.join([x.strftime("%Y%m%d") for x in self.time_range]) 
     else:
       time_range_str = 'all_time'  
@@ -191,39 +345,92 @@ class aeronet():
     ## Filter site
     extract = input_yes('Filter site?')
     if extract:
-      self.df,site_name = self.filter_site(self.df)
-      site_name = '_'+site_name if site_name else ''
-    else:
-      site_name = '' 
+      config['site'] = input('Site name? ')
+    site_name = '_'+config['site'] if config.get('site') else ''
 
     save_pickle = input_yes('Save pickle?')
     if save_pickle:
-      pickle_name = input_def('Pickle name to save?', 'COM20_{}{}.pkl'.format(time_range_str,site_name))      
-      self.df.to_pickle(self.pickle_path+pickle_name)
-      print(saved_as('COM', self.pickle_path+pickle_name))
+      config['save'] = input_def('File name to save? (.parquet, .feather or .pkl)',
+                                 store_name('COM20_{}{}.pkl'.format(time_range_str,site_name),store_fmt))
     else:
       print('Data not saved to pickle')
 
+    try:
+      aeronet_pipeline(config,self).run()
+    except FileNotFoundError as e:
+      print('\nError in loading data. Check file name and path. {}'.format(e))
+
     return
 
+  def raw_source_guide(self,data_name,config):
+    file_path_default = aod_data_path if data_name == 'AOD' else inv_data_path
+    pickle_name_default = pickle_aod_all_name if data_name == 'AOD' else pickle_inv_all_name
+
+    path = input_def('Enter directory of raw files?', data_path)
+    config['n_workers'] = int(input_def('Number of worker processes?', config.get('n_workers',1)))
+    read_tar = input('Read from .tar? Type "YES" for yes: ')
+    if read_tar in ['YES','yes']:
+      source = {'tar': path+input('Name of .tar file? '),
+                'member_path': input_def('Path for files in .tar?', file_path_default)}
+    else:
+      source = {'raw': input_def('Path for files?', path+file_path_default)}
+
+    source['skim'] = input_yes('Skim data?')
+    if input_yes('Save {} data (all records)?'.format(data_name)):
+      source['save'] = input_def('File name to save? (.parquet, .feather or .pkl)',
+                                 store_name(pickle_name_default,store_fmt))
+    return source
+
   ## From pickle
+  @profiled
   def load_pickle(self, pickle_name, pickle_path=None):
     print('Loading AERONET data from pickle: {}'.format(pickle_name))
     pickle_path = pickle_path or self.pickle_path
-    self.df = pd.read_pickle(pickle_path+self.pickle_name)
+    self.df = read_df(pickle_path+pickle_name)
 
+  @profiled
   def load_pickle_all(self,data_name,pickle_name):
 
+    # Prefer the columnar store once the pickle has been migrated
+    if os.path.exists(self.pickle_path+store_name(pickle_name,store_fmt)):
+      pickle_name = store_name(pickle_name,store_fmt)
     pickle_name = self.pickle_path+input_def('Pickle name?', pickle_name)
     print('Loading AERONET {} all site data from pickle: {}'.format(data_name, pickle_name))
-    df = pd.read_pickle(pickle_name)
+    df = read_df(pickle_name)
 
     print('Loaded AERONET {} all site data from pickle: {}'.format(data_name, pickle_name))
     print('************')
 
     return df
 
+  ## From columnar store
+  @profiled
+  def load_store(self, store_name, columns=None, time_range=None, sites=None, store_path=None):
+    store_path = store_path or self.pickle_path
+    if store_format(store_name) == 'mmap':
+      print('Opening AERONET data store: {}'.format(store_name))
+      self.df = None
+      self._store = mmap_store(store_path+store_name)
+      self._store_view = {'columns':read_columns(columns,time_range,sites),
+                          'time_range':time_range, 'sites':sites}
+      rows = self._store.rows(sites,time_range)
+      print(f'Number of records: {len(range(self._store.n_rows)[rows]) if isinstance(rows,slice) else len(rows)}')
+      return
+    print('Loading AERONET data from store: {}'.format(store_name))
+    self.df = read_df(store_path+store_name,columns=columns,time_range=time_range,sites=sites)
+    print(f'Number of records: {len(self.df)}')
+
+  def migrate_pickles(self, pickle_names=None, fmt=store_fmt):
+    # Default: all-sites AOD/INV pickles and the combined COM20_*.pkl in pickle_path
+    if pickle_names is None:
+      pickle_names = [f for f in sorted(os.listdir(self.pickle_path))
+                      if f in [pickle_aod_all_name,pickle_inv_all_name] or
+                        (f.startswith('COM20_') and f.endswith('.pkl'))]
+
+    return [os.path.basename(migrate_pickle(self.pickle_path+f,fmt)) for f in pickle_names]
+
   ## From raw data
+  @profiled
   def extract_daily_from_raw(self, data_name):
 
     print('\n#### Load AERONET {} all site data from raw data ####'.format(data_name))
@@ -239,54 +446,183 @@ class aeronet():
 
     # Ask for raw file info
     path     = input_def('Enter directory of raw files?', data_path)
-    read_tar = input('Extract .tar? Type "YES" for yes: ')
+    read_tar = input('Read from .tar? Type "YES" for yes: ')
+    n_workers = int(input_def('Number of worker processes?', 1))
+
+    df = None
     if read_tar in ['YES','yes']:
       tar_name = input('Name of .tar file? ')
-      try: 
-        extract_tar(path+tar_name,path=path)
-      except:
+      member_path = input_def('Path for files in .tar?', file_path_default)
+      print('Loading AERONET {} all site data from {}'.format(data_name,path+tar_name))
+      try:
+        df = self.read_daily_tar(path+tar_name,member_path,n_workers=n_workers)
+      except (FileNotFoundError, tarfile.ReadError):
         print(f'Tarfile not found. {path+tar_name}\nCheck the filename and directory')
 
-    file_path   = input_def('Path for files?', path+file_path_default)
-
-    print('Loading AERONET {} all site data from {}'.format(data_name,file_path))
-    # Get all filenames from the directory
-    files = os.listdir(file_path)
-    end = files[0].index('.') - len(files[0])
-    sitenames = [f[18:end] for f in files]
-
-    # Read all files and merge into a datafile
-    single_site= []
-
-    for i in range(len(files)):
-      f = files[i]
-      draw_progress_bar((i+1)/len(files))
-      single_site.append(pd.read_table(file_path+f,header=6,delimiter=','))
-    df = pd.concat(single_site,ignore_index=True)
+    if df is None:
+      file_path   = input_def('Path for files?', path+file_path_default)
+      print('Loading AERONET {} all site data from {}'.format(data_name,file_path))
+      df = self.read_daily_files(file_path,n_workers=n_workers)
 
     skim = input_yes('\nSkim data?')
     if skim:
-      if data_name == 'AOD':
-        df = df[columns_to_keep + ['AOD_500nm','440-870_Angstrom_Exponent']]
-        df = df.replace(-999.0,np.nan)
-      else: # INV
-        df = self.skim_inv(df)
-
-    df['Date(dd:mm:yyyy)'] =df['Date(dd:mm:yyyy)'].apply(lambda x: datetime.datetime.strptime(x,'%d:%m:%Y'))
+      df = self.skim_daily(df,data_name)
 
     print('\nFinished extracting {} data from raw data'.format(data_name))
 
     save_pickle = input_yes('Save pickle?')
     if save_pickle:
-      pickle_name = input_def('Pickle name to save?', pickle_name_default)
+      pickle_name = input_def('File name to save? (.parquet, .feather or .pkl)',
+                              store_name(pickle_name_default,store_fmt))
       if not os.path.exists(self.pickle_path):
         os.makedirs(self.pickle_path)
-      df.to_pickle(self.pickle_path+pickle_name)
+      save_df(df,self.pickle_path+pickle_name)
       print(saved_as(df_name, self.pickle_path+pickle_name))
 
     return df
 
+  @profiled
+  def read_daily_files(self, file_path, n_workers=1):
+    # Read all files and merge into a datafile
+    # Files are sorted so that the row order does not depend on n_workers
+    files = sorted(os.listdir(file_path))
+    single_site = read_daily_files([file_path+f for f in files],n_workers=n_workers)
+    df = apply_ingest_schema(pd.concat(single_site,ignore_index=True))
+    print_memory(df)
+
+    return df
+
+  @profiled
+  def read_daily_tar(self, tar_name, member_path='', n_workers=1):
+    # Members are parsed straight from the archive, nothing is written to disk
+    single_site = read_daily_tar(tar_name,member_path,n_workers=n_workers)
+    df = apply_ingest_schema(pd.concat(single_site,ignore_index=True))
+    print_memory(df)
+
+    return df
+
+  @profiled
+  def skim_daily(self,df,data_name):
+    if data_name == 'AOD':
+      df = df[columns_to_keep + ['AOD_500nm','440-870_Angstrom_Exponent']]
+    else: # INV
+      df = self.skim_inv(df)
+    return df
+
+  ## Out-of-core
+  @profiled
+  def extract_daily_chunked(self, data_name, file_path, store_name=None, max_memory_mb=1000,
+                            time_range=None, columns=None, min_rec=0, n_workers=1):
+    all_sites_name = store_aod_all_name if data_name == 'AOD' else store_inv_all_name
+    if time_range:
+      # Rows of a time range never go to the all-sites store (update_daily would keep serving them)
+      if store_name == all_sites_name:
+        raise ValueError('Rows filtered by time_range cannot be saved as {}'.format(all_sites_name))
+      range_str = '_'.join([pd.Timestamp(x).strftime('%Y%m%d') for x in time_range])
+      store_name = store_name or '{}20_daily_chunked_{}.parquet'.format(data_name,range_str)
+    store_name = store_name or all_sites_name
+    columns = columns or ('SIZE' if data_name == 'INV' else ['AOD_500nm'])
+
+    batches = plan_batches([file_path+f for f in sorted(os.listdir(file_path))],max_memory_mb)
+    print('Processing {} site files in {} batches (target {} MB)'.format(
+          sum([len(b) for b in batches]),len(batches),max_memory_mb))
+
+    # Each batch is averaged on its own frame, self.df (and the caches tied to it) is not touched
+    store = parquet_appender(self.pickle_path+store_name)
+    ave = []
+    try:
+      for i, batch in enumerate(batches):
+        df = apply_ingest_schema(pd.concat(read_daily_files(batch,n_workers=n_workers,progress=False),
+                                           ignore_index=True))
+        df = self.skim_daily(df,data_name)
+        if time_range:
+          df = df[(df['Date(dd:mm:yyyy)'] > pd.Timestamp(time_range[0])) &
+                  (df['Date(dd:mm:yyyy)'] < pd.Timestamp(time_range[1]))]
+        if len(df):
+          store.append(df)
+          ave.append(site_average(df,columns,min_rec=min_rec))
+        df = None
+        draw_progress_bar((i+1)/len(batches))
+    finally:
+      store.close()
+
+    print(saved_as(data_name,self.pickle_path+store_name))
+    print(f'Number of records: {store.rows}')
+
+    return pd.concat(ave).sort_index() if ave else pd.DataFrame()
+
+  ## Incremental update
+  @profiled
+  def update_daily(self, data_name, file_path, store_name=None, n_workers=1):
+    store_name = store_name or (store_aod_all_name if data_name == 'AOD' else store_inv_all_name)
+    store_file    = self.pickle_path+store_name
+    manifest_file = self.pickle_path+manifest_name(store_name)
+
+    manifest = load_manifest(manifest_file)
+    files = scan_files(file_path)
+    plan = plan_update(manifest,files)
+    print('Update {}: {} new, {} appended, {} changed files'.format(
+          store_name,len(plan['new']),len(plan['appended']),len(plan['changed'])))
+    if plan['removed']:
+      print('Files removed since the last update (data kept): {}'.format(plan['removed']))
+
+    # Without a manifest the store is rebuilt from all files
+    df_old = read_df(store_file) if os.path.exists(store_file) and manifest['files'] else None
+    if not (plan['new'] or plan['appended'] or plan['changed']):
+      return df_old, []
+
+    # Whole files for new/changed, rows after the previous size for appended
+    full = plan['new']+plan['changed']
+    single_site = dict(zip(full,read_daily_files([file_path+f for f in full],n_workers=n_workers,progress=False)))
+    for f in plan['appended']:
+      single_site[f] = read_daily_file(file_path+f,offset=manifest['files'][f]['size'])
+
+    parts = []
+    for f, df_f in single_site.items():
+      df_f = apply_ingest_schema(df_f)
+      old = manifest['files'].get(f,{})
+      if f in plan['appended'] and old.get('last_date'):
+        df_f = df_f[df_f['Date(dd:mm:yyyy)'] > pd.Timestamp(old['last_date'])]
+      site_col = [c for c in site_columns if c in df_f.columns][0]
+      manifest['files'][f] = {**files[f],
+          'site'     : str(df_f[site_col].iloc[0]) if len(df_f) else old.get('site'),
+          'last_date': str(df_f['Date(dd:mm:yyyy)'].max()) if len(df_f) else old.get('last_date')}
+      if len(df_f):
+        parts.append(df_f)
+
+    sites = sorted({manifest['files'][f]['site'] for f in single_site} - {None})
+    replaced = [manifest['files'][f]['site'] for f in plan['changed']]
+
+    if parts:
+      df_new = self.skim_daily(pd.concat(parts,ignore_index=True),data_name)
+      if df_old is not None:
+        df_old = df_old[~df_old['AERONET_Site_Name'].isin(replaced)]
+      df = pd.concat([df_old,df_new],ignore_index=True)
+      df['AERONET_Site_Name'] = df['AERONET_Site_Name'].astype('category')
+    else:
+      df = df_old
+
+    save_df(df,store_file)
+    save_manifest(manifest,manifest_file)
+    print(saved_as(data_name,store_file))
+    print('Updated sites: {}'.format(len(sites)))
+
+    if data_name == 'AOD':
+      self.df_aod_all = df
+    else:
+      self.df_inv_all = df
+
+    return df, sites
+
+  @profiled
+  def update_average(self, df_ave, sites, columns=['AOD_500nm'], min_rec=0):
+    # cal_average of self.df, recomputed for sites only
+    df_sites = self.cal_average(columns,min_rec=min_rec,sites=sites)
+    df_ave = pd.concat([df_ave[~df_ave.index.isin(sites)],df_sites])
+    return df_ave.sort_index()
+
   ## INV daily data
+  @profiled
   def skim_inv(self,df):
     df=df.rename(columns=inv_col_to_aod_col)
     # size_bins = sorted(['{:.6f}'.format(float(c)) for c in df.columns if '.' in c and 'N[' not in c])
@@ -302,43 +638,79 @@ class aeronet():
       keys_all_size  = ['{}-{}'.format(k,s) for k in keys_with_size for s in keys_size]
       keys_all       = keys_all_size+keys_no_size
 
-      pairs = [['{}[{}]'.format(k,wl[0]), '{}[{}]'.format(k,wl[1])]
-              for k in keys_all for wl in wl_pairs]
-      cols = ['{}[{}]'.format(k,w)
-              for k in keys_all for wl in wl_pairs for w in wl]
-
-      df = df[columns_to_keep + columns_reff + size_bins + cols]
-      df = df.replace(-999.0,np.nan)
+      v1 = ['{}[{}]'.format(k,wl[0]) for k in keys_all for wl in wl_pairs]
+      v2 = ['{}[{}]'.format(k,wl[1]) for k in keys_all for wl in wl_pairs]
 
-      for [v1, v2] in pairs:
-        df[v1] = df[v1].combine_first(df[v2])
-        df     = df.drop(columns=[v2])
+      # All pairs in one block: the first wavelength, the second where it is missing
+      first, second = df[v1].to_numpy(), df[v2].to_numpy()
+      df_pairs = pd.DataFrame(np.where(np.isnan(first),second,first),columns=v1,index=df.index)
+      df = pd.concat([df[columns_to_keep + columns_reff + size_bins],df_pairs],axis=1)
       print('Volume distribution and AOD data is kept.')
     except:
       df = df[size_bins]
-      df = df.replace(-999.0,np.nan)
       print('No AOD data. Only volume distribution is kept.')
 
-    # Bins
+    # Bins (-999 is already NaN, see analysis_utils.read_daily_file)
     size_dict = {size_bins[i]:'Bin {}'.format(i+1) for i in range(len(size_bins))}
     df=df.rename(columns=size_dict)
-    df = df.replace(-999.0,np.nan)
 
-    # Convert size bin info into one columns
-    df['dV/dlnr'] = df[list(size_dict.values())].values.tolist()
+    # dV/dlnr as a (rows x 22) array: df.dvdlnr.values
 
     return df
 
   ## Combine
-  def combine_df(self):
-    df = pd.merge(self.df_aod_all, self.df_inv_all, how='outer',
-                  on=columns_to_keep)
+  @profiled
+  def combine_df(self,method='keyed'):
+    df = None
+    shared = set(self.df_aod_all.columns) & set(self.df_inv_all.columns) - set(columns_to_keep)
+    if method == 'keyed' and not shared:
+      # Integer (site, date) keys, None if they are not unique in AOD or INV
+      df = join_site_date(self.df_aod_all, self.df_inv_all, columns_to_keep)
+    if df is None:
+      df = pd.merge(self.df_aod_all, self.df_inv_all, how='outer',
+                    on=columns_to_keep)
+      # Merging categoricals with different categories gives object
+      df['AERONET_Site_Name'] = df['AERONET_Site_Name'].astype('category')
     return df
 
+  ## Site/date index
+  def site_index(self):
+    if self._site_index is None:
+      self._site_index = site_date_index(self.df)
+    return self._site_index
+
+  def site_data(self,site,time_range=None):
+    if self._df is None and self._store is not None:
+      return self.store_site_data(site,time_range)
+    return self.df.iloc[self.site_index().rows(site,time_range)]
+
+  def store_site_data(self,site,time_range):
+    # Rows of the site within the view of the opened store, without materializing self.df
+    view = self._store_view
+    if view['sites'] is not None and site not in view['sites']:
+      site = None
+    if time_range and view['time_range']:
+      time_range = [max(pd.Timestamp(time_range[0]),pd.Timestamp(view['time_range'][0])),
+                    min(pd.Timestamp(time_range[1]),pd.Timestamp(view['time_range'][1]))]
+    return self._store.frame(view['columns'],sites=[site],time_range=time_range or view['time_range'])
+
+  def site_mask(self,sites=None):
+    # Boolean mask of the rows of sites (all rows if None)
+    if sites is None:
+      return np.ones(len(self.df),dtype=bool)
+    mask = np.zeros(len(self.df),dtype=bool)
+    for site in sites:
+      mask[self.site_index().rows(site)] = True
+    return mask
+
   ## Filters
+  @profiled
   def filter_time(self,df,time_range):
-    df2 = df[(df['Date(dd:mm:yyyy)'] > time_range[0]) &
-             (df['Date(dd:mm:yyyy)'] < time_range[1])]
+    if df is self.df:
+      df2 = df.iloc[self.site_index().time_rows(time_range)]
+    else:
+      df2 = df[(df['Date(dd:mm:yyyy)'] > pd.Timestamp(time_range[0])) &
+               (df['Date(dd:mm:yyyy)'] < pd.Timestamp(time_range[1]))]
     if len(df2) < 1:
       print(f'Not record in this time range: {time_range}') 
       return df
@@ -347,14 +719,23 @@ class aeronet():
       print(f'Number of records: {len(df2)}')
       return df2
 
-  def filter_site(self,df):
-    site_name = input('Site name? ')
+  @profiled
+  def filter_site(self,df,site_name=None):
+    interactive = site_name is None
+    if interactive:
+      site_name = input('Site name? ')
     df2 = []
     while site_name and len(df2)<1:
-      df2 = df[df['AERONET_Site_Name'] == site_name]
+      if df is self.df:
+        df2 = self.site_data(site_name)
+      else:
+        df2 = df[df['AERONET_Site_Name'] == site_name]
       if len(df2) < 1: 
+        if not interactive:
+          raise KeyError('No data at the site {}'.format(site_name))
         print('No data at the specified site.')
-        site_name = input('Site name? ') 
+        site_name = input('Site name? ')
+
       
     
     if site_name == '':
@@ -365,37 +746,99 @@ class aeronet():
       print(f'Number of records: {len(df2)}')
       return df2, site_name
 
+  @profiled
   def filter_rec(self,df,min_rec=0,columns=['AOD_500nm']):
-    nrec = (df[['AERONET_Site_Name']+columns]
-              .dropna()
-              .groupby('AERONET_Site_Name')
-              .count())
-    nrec = nrec[nrec[columns[0]] > min_rec]
-    df2 = df[df['AERONET_Site_Name'].isin(list(nrec.index))][columns_def+columns]
+    g = grouping(df['AERONET_Site_Name'], mask=df[columns].notna().all(axis=1).values)
+    sites = g.labels[g.size() > min_rec]
+    df2 = df[df['AERONET_Site_Name'].isin(list(sites))][columns_def+columns]
 
     return df2
 
   ## Calculate averages
-  def cal_average(self,columns=['AOD_500nm'],min_rec=0):
-
-    if type(columns)==str and columns.upper() == 'SIZE':
-      columns = [c  for c in self.df.columns if 'Bin' in c]
-    
-    df = self.df[columns_def+columns]
-    df_ave = (df.dropna().groupby('AERONET_Site_Name').mean())
-    df_ave['Day_of_Year'] = df.dropna().groupby('AERONET_Site_Name')['Day_of_Year'].apply(list)
-    df_ave['Record_number'] = df_ave['Day_of_Year'].apply(lambda x: len(x))
-    if min_rec>0:
-      df_ave = df_ave[df_ave['Record_number']>= min_rec]
+  @profiled
+  @memoize
+  def cal_average(self,columns=['AOD_500nm'],min_rec=0,stats=[],sites=None):
+    return site_average(self.df,columns,min_rec,stats,mask=self.site_mask(sites))
 
-    return df_ave
+  @profiled
+  def cal_size_average(self,min_rec=0,sites=None):
+    return size_average(self.df,min_rec,mask=self.site_mask(sites))
 
   ## Select sites
-  def select_sites(self,lat=[0,30],lon=[0,10]):
-
-    df_trim = self.df[(self.df['Site_Latitude(Degrees)']>lat[0]) & \
-                      (self.df['Site_Latitude(Degrees)']<lat[1]) & \
-                      (self.df['Site_Longitude(Degrees)']>lon[0]) & \
-                      (self.df['Site_Longitude(Degrees)']<lon[1])]
+  def site_locator(self):
+    if self._site_locator is None:
+      self._site_locator = site_locator(self.df)
+    return self._site_locator
 
-    return list(df_trim["AERONET_Site_Name"].unique()) # Return site names only
+  @profiled
+  @memoize
+  def select_sites(self,lat=[0,30],lon=[0,10]):
+    return self.site_locator().bbox(lat,lon) # Return site names only
+
+  @profiled
+  @memoize
+  def select_sites_radius(self,lat,lon,radius_km=100):
+    return self.site_locator().radius(lat,lon,radius_km)
+
+  @profiled
+  @memoize
+  def nearest_sites(self,lat,lon,k=1):
+    return self.site_locator().nearest(lat,lon,k)
+
+  ## Monthly cube
+  @profiled
+  def monthly_cube(self,columns=None):
+    cube = self._monthly_cube
+    if cube is not None and (columns is None or set(columns) <= set(cube.variables())):
+      return cube
+    if cube is not None:
+      # Rebuilt with the columns already in the cube and the missing ones
+      columns = cube.variables()+[c for c in columns if c not in cube.variables()]
+    self._monthly_cube = monthly_cube(self.df,columns)
+    return self._monthly_cube
+
+  @profiled
+  def save_monthly_cube(self,store_name=None):
+    filename = self.pickle_path+cube_name(store_name or self.pickle_name)
+    self.monthly_cube().save(filename)
+    print(saved_as('monthly cube',filename))
+
+  @profiled
+  def load_monthly_cube(self,store_name=None):
+    filename = self.pickle_path+cube_name(store_name or self.pickle_name)
+    self._monthly_cube = read_cube(filename)
+    if self.cache:
+      self.cache.clear()
+    print('Loaded monthly cube: {}'.format(filename))
+
+  ## Daily series
+  @profiled
+  @memoize
+  def daily_series(self,columns=['AOD_500nm'],sites=None,time_range=None):
+    return daily_series(self.df,columns,sites,time_range)
+
+  ## Model collocation
+  @profiled
+  def collocate(self,field,var='AOD_500nm',method='nearest',time_match='day'):
+    return collocation(field,self.site_locator().coords(),method).pairs(self.df,var,time_match)
+
+  ## Gridding
+  @profiled
+  @memoize
+  def grid_cube(self,columns=['AOD_500nm'],grid=1.0,time='month',site_mean=False,time_range=None):
+    rows = self.site_index().time_rows(time_range) if time_range else slice(None)
+    return grid_cube(self.df.iloc[rows],columns,grid,time,site_mean)
+
+  ## Result cache
+  def cached(self,name,args,func):
+    key = result_key(name,args,self._df_version)
+    if self.cache is None or key is None:
+      return func()
+    hit, value = self.cache.get(key)
+    if not hit:
+      value = func()
+      self.cache.put(key,value)
+    return value
+
+  def cache_stats(self):
+    return self.cache.stats() if self.cache else {}
@@ -0,0 +1,295 @@
+'''''
+
+Benchmarks for AERONET data processing
+
+Functions:
+- bench_read_daily(file_path, n_workers) : return df_result
+  - Throughput of the serial (n_workers=1) and process pool readers
+- bench_chunked(file_path, max_memory_mb, data_name) : return df_result
+  - Python heap peak (tracemalloc) of aeronet.extract_daily_chunked for
+    each target, checked against the target
+- bench_combine(aod_store, inv_store) : return df_result
+  - Time and Python heap peak (tracemalloc) of aeronet.combine_df, keyed
+    join against pd.merge, on the stored all-sites tables
+- bench_import(statements, repeat) : return df_result
+  - Time of each import statement in a new interpreter (median of repeat)
+    and whether it loaded matplotlib/plotly/pyarrow
+- bench_suite(n_sites, n_years, output, repeat, root) : return dict of results
+  - Time (best of repeat) and Python heap peak (tracemalloc) of each stage on
+    synthetic data (aeronet_synthetic): ingest, skim_inv, combine_df,
+    filter_time, cal_average, select_sites and the size distribution plots
+  - output: JSON file of the results and the versions, to compare runs
+- compare_runs(base, new, threshold, min_time_s) : return df_result
+  - Ratios of time and peak between two bench_suite outputs, stages slower
+    (by more than min_time_s) or larger than 1+threshold are flagged
+
+Usage:
+  python -m aerosol_obs_analysis.aeronet_benchmark AOD/AOD20/DAILY/ 1 2 4
+  python -m aerosol_obs_analysis.aeronet_benchmark --chunked INV/LEV20/ALL/DAILY/ 50 200 1000
+  python -m aerosol_obs_analysis.aeronet_benchmark --import
+  python -m aerosol_obs_analysis.aeronet_benchmark --suite 200 5 workspace/benchmark/suite.json
+  python -m aerosol_obs_analysis.aeronet_benchmark --compare base.json suite.json
+  python -m aerosol_obs_analysis.aeronet_benchmark --combine workspace/AERONET/AOD20_daily_all_sites.parquet workspace/AERONET/INV20_daily_all_sites.parquet
+
+'''''
+import os
+import sys
+import time
+import tracemalloc
+import subprocess
+import io
+import json
+import platform
+import datetime
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+from .analysis_utils import read_daily_files
+
+def bench_read_daily(file_path, n_workers=[1,2,4]):
+  files = [file_path+f for f in sorted(os.listdir(file_path))]
+  size_mb = sum([os.path.getsize(f) for f in files])/1e6
+
+  print(f'Benchmark reading {len(files)} files ({size_mb:.1f} MB) from {file_path}')
+  results = []
+  for n in n_workers:
+    t0 = time.perf_counter()
+    single_site = read_daily_files(files,n_workers=n,progress=False)
+    t = time.perf_counter() - t0
+    results.append({'n_workers'  : n,
+                    'time_s'     : t,
+                    'files_per_s': len(files)/t,
+                    'MB_per_s'   : size_mb/t,
+                    'rows'       : sum([len(df) for df in single_site])})
+
+  df_result = pd.DataFrame(results).set_index('n_workers')
+  df_result['speedup'] = df_result['time_s'].iloc[0]/df_result['time_s']
+  print(df_result)
+
+  return df_result
+
+def bench_chunked(file_path, max_memory_mb=[50,200,1000], data_name='INV'):
+  from .aeronet_analysis import aeronet
+  from .aeronet_chunked import plan_batches, expansion_default
+
+  files = [file_path+f for f in sorted(os.listdir(file_path))]
+  size_mb = sum([os.path.getsize(f) for f in files])/1e6
+  data = aeronet(pickle_path='workspace/benchmark/')
+
+  print(f'Benchmark chunked {data_name} processing of {len(files)} files ({size_mb:.1f} MB)')
+  results = []
+  for target in max_memory_mb:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    data.extract_daily_chunked(data_name,file_path,store_name=f'chunked_{target}MB.parquet',
+                               max_memory_mb=target)
+    t = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    results.append({'target_MB' : target,
+                    'batches'   : len(plan_batches(files,target)),
+                    'peak_MB'   : peak,
+                    'time_s'    : t,
+                    # A single file larger than the target can not be split
+                    'within'    : peak <= max(target,max_file_mb(files)*expansion_default)})
+
+  df_result = pd.DataFrame(results).set_index('target_MB')
+  print(df_result)
+  if not df_result['within'].all():
+    print('Peak memory above the target: {}'.format(list(df_result.index[~df_result['within']])))
+
+  return df_result
+
+def max_file_mb(files):
+  return max([os.path.getsize(f) for f in files])/1e6
+
+def bench_combine(aod_store, inv_store, repeat=3):
+  from .aeronet_analysis import aeronet
+  from .aeronet_store import read_df
+
+  data = aeronet(pickle_path='workspace/benchmark/')
+  data.df_aod_all = read_df(aod_store)
+  data.df_inv_all = read_df(inv_store)
+
+  print(f'Benchmark combine_df of {len(data.df_aod_all)} AOD and {len(data.df_inv_all)} INV records')
+  results, rows = [], {}
+  for method in ['merge','keyed']:
+    t0 = time.perf_counter()
+    for i in range(repeat):
+      df = data.combine_df(method)
+    t = (time.perf_counter() - t0)/repeat
+    del df
+
+    tracemalloc.start()
+    df = data.combine_df(method)
+    peak = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+    rows[method] = len(df)
+    del df
+    results.append({'method':method, 'time_s':t, 'peak_MB':peak, 'rows':rows[method]})
+
+  df_result = pd.DataFrame(results).set_index('method')
+  df_result['speedup'] = df_result.loc['merge','time_s']/df_result['time_s']
+  print(df_result)
+  if rows['merge'] != rows['keyed']:
+    print('Different number of rows: lat/lon or Day_of_Year of some records differ between AOD and INV')
+
+  return df_result
+
+import_statements = ['import aerosol_obs_analysis',
+                     'import aerosol_obs_analysis; aerosol_obs_analysis.plot_single_site']
+heavy_modules = ['matplotlib','plotly','pyarrow']
+
+import_code = """
+import sys, time
+t0 = time.perf_counter()
+{}
+t = time.perf_counter()-t0
+print(t, *[m in sys.modules for m in {}])
+"""
+
+def bench_import(statements=import_statements, repeat=5):
+  # Run from the directory containing the package
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+  results = []
+  for statement in statements:
+    code = import_code.format(statement,heavy_modules)
+    runs = [subprocess.run([sys.executable,'-c',code],cwd=root,capture_output=True,
+                           text=True,check=True).stdout.split() for i in range(repeat)]
+    times = sorted([float(r[0]) for r in runs])
+    results.append({'import':statement, 'time_s':times[len(times)//2],
+                    **{m:r == 'True' for m, r in zip(heavy_modules,runs[0][1:])}})
+
+  df_result = pd.DataFrame(results).set_index('import')
+  print(df_result.to_string())
+
+  return df_result
+
+def run_stage(func, repeat=3):
+  # Best time of repeat, then the heap peak of one more run; the prints of the stage are dropped
+  times = []
+  with contextlib.redirect_stdout(io.StringIO()):
+    for i in range(repeat):
+      t0 = time.perf_counter()
+      result = func()
+      times.append(time.perf_counter() - t0)
+    del result
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]/1e6
+    tracemalloc.stop()
+  return result, min(times), peak
+
+def bench_suite(n_sites=100, n_years=2, output=None, repeat=3, root=None):
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+  from .aeronet_analysis import aeronet
+  from .aeronet_synthetic import write_synthetic
+  from .single_site_size_plot import plot_single_site_size
+
+  tmp = tempfile.TemporaryDirectory()
+  if root is None:
+    root = tmp.name+'/'
+    with contextlib.redirect_stdout(io.StringIO()):
+      write_synthetic(root,n_sites=n_sites,n_years=n_years)
+  paths = {'AOD':root+'AOD/AOD20/DAILY/', 'INV':root+'INV/LEV20/ALL/DAILY/'}
+  # No result cache, every repeat computes
+  data = aeronet(pickle_path=tmp.name+'/work/',cache_mb=0)
+  raw = {}
+
+  def combine():
+    data.df = data.combine_df()
+    return data.df
+
+  def size_plots():
+    plot = plot_single_site_size(data)
+    sites = list(plot.aeronet_size_agg.index[:10])
+    plot.render_dvdlnr(sites,savedir=tmp.name+'/plots/')
+    plot.plot_dV_time(sites[0])
+    plt.close('all')
+    return plot.aeronet_size_agg
+
+  period = [] # First year of the data, set after combine_df
+  stages = [('ingest_aod',  lambda: data.read_daily_files(paths['AOD'])),
+            ('ingest_inv',  lambda: data.read_daily_files(paths['INV'])),
+            ('skim_aod',    lambda: data.skim_daily(raw['AOD'],'AOD')),
+            ('skim_inv',    lambda: data.skim_inv(raw['INV'])),
+            ('combine_df',  combine),
+            ('filter_time', lambda: data.filter_time(data.df,period)),
+            ('cal_average', lambda: data.cal_average(['AOD_500nm','440-870_Angstrom_Exponent'])),
+            ('cal_average_size', lambda: data.cal_average('SIZE')),
+            ('select_sites', lambda: data.select_sites([-30,30],[-100,100])),
+            ('size_plots',  size_plots)]
+
+  print(f'Benchmark suite: {n_sites} sites, {n_years} years of synthetic data in {root}')
+  results = {}
+  for name, func in stages:
+    result, t, peak = run_stage(func,repeat)
+    results[name] = {'time_s':t, 'peak_MB':peak, 'rows':len(result)}
+    if name == 'ingest_aod': raw['AOD'] = result
+    if name == 'ingest_inv': raw['INV'] = result
+    if name == 'skim_aod':   data.df_aod_all = result
+    if name == 'skim_inv':   data.df_inv_all = result
+    if name == 'combine_df':
+      year = data.df['Date(dd:mm:yyyy)'].min().year
+      period += [datetime.date(year,1,1),datetime.date(year,12,31)]
+    print('{:18s} {:8.3f} s {:9.1f} MB {:9d} rows'.format(name,t,peak,len(result)))
+
+  run = {'meta': {'date'     : datetime.datetime.now().isoformat(timespec='seconds'),
+                  'n_sites'  : n_sites,
+                  'n_years'  : n_years,
+                  'repeat'   : repeat,
+                  'python'   : platform.python_version(),
+                  'numpy'    : np.__version__,
+                  'pandas'   : pd.__version__,
+                  'machine'  : platform.machine(),
+                  'cpu_count': os.cpu_count()},
+         'stages': results}
+  if output:
+    if os.path.dirname(output):
+      os.makedirs(os.path.dirname(output),exist_ok=True)
+    with open(output,'w') as f:
+      json.dump(run,f,indent=2)
+    print(f'Results saved as {output}')
+  tmp.cleanup()
+  return run
+
+def compare_runs(base, new, threshold=0.2, min_time_s=0.005):
+  runs = []
+  for run in [base,new]:
+    if isinstance(run,str):
+      with open(run) as f:
+        run = json.load(f)
+    runs.append(pd.DataFrame(run['stages']).T)
+
+  df_result = pd.DataFrame({'time_s_base': runs[0]['time_s'],
+                            'time_s'     : runs[1]['time_s'],
+                            'peak_MB_base': runs[0]['peak_MB'],
+                            'peak_MB'    : runs[1]['peak_MB']}).dropna()
+  df_result['time_ratio'] = df_result['time_s']/df_result['time_s_base']
+  df_result['peak_ratio'] = df_result['peak_MB']/df_result['peak_MB_base']
+  # Stages faster than min_time_s are within the timer noise
+  slower = (df_result['time_ratio'] > 1+threshold) & (df_result['time_s']-df_result['time_s_base'] > min_time_s)
+  df_result['regression'] = slower | (df_result['peak_ratio'] > 1+threshold)
+  print(df_result.to_string(float_format='{:.3f}'.format))
+  if df_result['regression'].any():
+    print('Slower or larger than {:.0%} of the base: {}'.format(1+threshold,list(df_result.index[df_result['regression']])))
+
+  return df_result
+
+if __name__ == '__main__':
+  if sys.argv[1] == '--suite':
+    bench_suite(*[int(n) for n in sys.argv[2:4]],*sys.argv[4:5])
+  elif sys.argv[1] == '--compare':
+    compare_runs(sys.argv[2],sys.argv[3])
+  elif sys.argv[1] == '--import':
+    bench_import()
+  elif sys.argv[1] == '--combine':
+    bench_combine(sys.argv[2],sys.argv[3])
+  elif sys.argv[1] == '--chunked':
+    bench_chunked(sys.argv[2],max_memory_mb=[float(n) for n in sys.argv[3:]] or [50,200,1000])
+  else:
+    bench_read_daily(sys.argv[1],n_workers=[int(n) for n in sys.argv[2:]] or [1,2,4])
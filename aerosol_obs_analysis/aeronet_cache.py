@@ -0,0 +1,115 @@
+'''''
+
+Result cache of the aeronet analysis methods
+
+Results are kept by method name, arguments (defaults filled in) and the
+version of aeronet.df, which is incremented and the cache cleared
+whenever df is reassigned (load_pickle, filter results, ...). Least
+recently used results are evicted to keep the cache under max_mb.
+
+class result_cache
+methods:
+  - __init__(max_mb)
+  - get   (key)       : return hit, value
+  - put   (key,value) : results larger than max_mb are not kept
+  - clear ()
+  - stats ()          : return dict of hits, misses, evictions, entries, size_mb, max_mb
+
+functions:
+  - memoize(method)   : decorator of aeronet methods, cached by aeronet.cached(name,args,func)
+  - result_key(name,args,version) : return hashable key, None if an argument is not hashable
+
+A hit returns a copy (a deep copy of result objects such as daily_series
+and grid_cube), so the cached result is not changed by the caller.
+
+'''''
+import sys
+import copy
+import functools
+import inspect
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+def freeze(value):
+  if isinstance(value,(list,tuple)):
+    return tuple(freeze(v) for v in value)
+  if isinstance(value,dict):
+    return tuple(sorted((k,freeze(v)) for k,v in value.items()))
+  if isinstance(value,np.ndarray):
+    return (value.dtype.str,value.shape,value.tobytes())
+  hash(value)
+  return value
+
+def result_key(name,args,version):
+  try:
+    return (name,freeze(args),version)
+  except TypeError:
+    return None
+
+def result_size(value):
+  if isinstance(value,(pd.DataFrame,pd.Series,pd.Index)):
+    size = value.memory_usage(deep=True)
+    return int(size.sum()) if hasattr(size,'sum') else int(size)
+  if isinstance(value,np.ndarray) or hasattr(value,'nbytes'):
+    return value.nbytes
+  if isinstance(value,(list,tuple)):
+    return sys.getsizeof(value) + sum([sys.getsizeof(v) for v in value])
+  return sys.getsizeof(value)
+
+def copy_result(value):
+  # DataFrame, array, list: their own copy; result objects (daily_series, grid_cube) a deep copy
+  return value.copy() if hasattr(value,'copy') else copy.deepcopy(value)
+
+class result_cache():
+
+  def __init__(self,max_mb=256):
+    self.max_bytes = max_mb*1e6
+    self.entries = OrderedDict() # key: (value, size), oldest first
+    self.size = 0
+    self.hits = self.misses = self.evictions = 0
+
+  def get(self,key):
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return True, copy_result(self.entries[key][0])
+    self.misses += 1
+    return False, None
+
+  def put(self,key,value):
+    size = result_size(value)
+    if size > self.max_bytes:
+      return
+    if key in self.entries:
+      self.size -= self.entries.pop(key)[1]
+    self.entries[key] = (copy_result(value),size)
+    self.size += size
+    while self.size > self.max_bytes:
+      self.size -= self.entries.popitem(last=False)[1][1]
+      self.evictions += 1
+
+  def clear(self):
+    self.entries.clear()
+    self.size = 0
+
+  def stats(self):
+    return {'hits'     : self.hits,
+            'misses'   : self.misses,
+            'evictions': self.evictions,
+            'entries'  : len(self.entries),
+            'size_mb'  : self.size/1e6,
+            'max_mb'   : self.max_bytes/1e6}
+
+def memoize(method):
+  signature = inspect.signature(method)
+
+  @functools.wraps(method)
+  def wrapper(self,*args,**kwargs):
+    # Key from all arguments with the defaults, so f() and f(default) share a result
+    bound = signature.bind(self,*args,**kwargs)
+    bound.apply_defaults()
+    key_args = list(bound.arguments.items())[1:]
+    return self.cached(method.__name__,key_args,lambda: method(self,*args,**kwargs))
+
+  return wrapper
@@ -0,0 +1,71 @@
+'''''
+
+Out-of-core processing of the all-sites daily products
+
+The site files are read in batches whose estimated size in memory stays
+below a peak-memory target. Each batch goes through
+  read -> skim -> filter time -> average
+and its rows are appended to a Parquet file before the next batch is
+read, so only one batch is held at a time. A site is in one file, so
+the per-site averages of a batch are final and are concatenated.
+
+Functions:
+  - estimate_memory(filenames,expansion) : return bytes
+    - File size (text) times expansion, the peak of parsing and skimming
+      relative to the text size
+  - plan_batches(filenames,max_memory_mb,expansion) : return list_of_batches
+    - Consecutive files, a single file larger than the target is its own batch
+  - parquet_appender(filename)            : .append(df), .close()
+
+Used by aeronet.extract_daily_chunked.
+
+'''''
+import os
+from .aeronet_store import row_group_size
+
+date_col = 'Date(dd:mm:yyyy)'
+
+# Peak bytes per byte of text (about 1.5 measured): the parsed files, the
+# concatenated batch and the skimmed copy coexist while a batch is processed
+expansion_default = 2.0
+
+def estimate_memory(filenames,expansion=expansion_default):
+  return sum([os.path.getsize(f) for f in filenames])*expansion
+
+def plan_batches(filenames,max_memory_mb=1000,expansion=expansion_default):
+  batches, batch, batch_bytes = [], [], 0
+  for f in filenames:
+    f_bytes = estimate_memory([f],expansion)
+    if batch and batch_bytes+f_bytes > max_memory_mb*1e6:
+      batches.append(batch)
+      batch, batch_bytes = [], 0
+    batch.append(f)
+    batch_bytes += f_bytes
+  if batch:
+    batches.append(batch)
+  return batches
+
+class parquet_appender():
+
+  def __init__(self,filename):
+    self.filename = filename
+    self.writer = None
+    self.rows = 0
+
+  def append(self,df):
+    # Each batch is one or more row groups, sorted by date within the batch
+    df = df.sort_values(by=date_col,kind='mergesort').reset_index(drop=True)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(df,preserve_index=False)
+    if self.writer is None:
+      self.writer = pq.ParquetWriter(self.filename,table.schema)
+    else:
+      # Categories differ between batches, the dictionary is stored per row group
+      table = table.cast(self.writer.schema)
+    self.writer.write_table(table,row_group_size=row_group_size)
+    self.rows += len(df)
+
+  def close(self):
+    if self.writer is not None:
+      self.writer.close()
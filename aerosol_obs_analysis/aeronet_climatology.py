@@ -0,0 +1,141 @@
+'''''
+
+Monthly aggregate cube of AERONET data
+
+Count, mean and standard deviation of the measurement columns by site
+and month (site x month x variable), computed in one grouped pass over
+aeronet.df. The single site plots take their monthly and seasonal values
+from the cube, not from the daily records.
+
+class monthly_cube
+methods:
+  - __init__(df,columns)      : columns default all float columns (lat/lon included)
+    - table: cube read back by read_cube instead of df
+  - monthly    (site,var)     : return df of the monthly mean, index date_month, column var
+    - Same as a groupby of the site's records with var by month
+  - stats      (site,var)     : return df of count/mean/std by month
+  - climatology(site,var,by)  : return df of count/mean/std pooled by calendar 'month' or 'season'
+  - coords     (site)         : return lat, lon
+  - site_names ()             : return list_of_site_names
+  - variables  ()             : return list of the columns in the cube
+  - save       (filename)     : .parquet/.feather/.pkl
+
+functions:
+  - read_cube(filename)       : return monthly_cube
+  - cube_name(store_name)     : return file name of the cube saved next to a store
+
+Months without a valid value of var are left out (count 0).
+
+'''''
+import os
+import numpy as np
+import pandas as pd
+from .aeronet_aggregate import grouping
+from .aeronet_store import save_df, read_df
+
+site_col  = 'AERONET_Site_Name'
+date_col  = 'Date(dd:mm:yyyy)'
+lat_col   = 'Site_Latitude(Degrees)'
+lon_col   = 'Site_Longitude(Degrees)'
+month_col = 'date_month'
+
+cube_stats = ['count','mean','std']
+seasons = {12:'DJF', 1:'DJF',  2:'DJF',  3:'MAM',  4:'MAM',  5:'MAM',
+            6:'JJA', 7:'JJA',  8:'JJA',  9:'SON', 10:'SON', 11:'SON'}
+
+def cube_name(store_name):
+  root, ext = os.path.splitext(store_name)
+  return root+'_monthly'+ext
+
+def read_cube(filename):
+  df = read_df(filename)
+  table = df.set_index([site_col,month_col])
+  table.columns = pd.MultiIndex.from_tuples([tuple(c.rsplit('_',1)) for c in table.columns])
+  return monthly_cube(table=table)
+
+class monthly_cube():
+
+  def __init__(self,df=None,columns=None,table=None,chunk=16):
+    if table is None:
+      table = self.build(df,columns,chunk)
+    self.table = table
+
+    # Rows of each site, the table is sorted by (site, month)
+    sites = table.index.get_level_values(0)
+    codes = pd.factorize(sites)[0]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.zeros(0,dtype=int)
+    stops  = np.r_[starts[1:], len(codes)].astype(int)
+    self.offsets = {str(site):(start,stop) for site,start,stop in zip(np.asarray(sites)[starts],starts,stops)}
+    self.months  = table.index.get_level_values(1)
+    self.columns = {c: table[c].to_numpy() for c in table.columns}
+
+  def build(self,df,columns,chunk):
+    if columns is None:
+      columns = [c for c in df.columns if df[c].dtype.kind == 'f']
+
+    # One group per (site, month): site code * months spanned + month offset
+    codes, sites = pd.factorize(df[site_col], sort=True)
+    months = df[date_col].values.astype('datetime64[M]').view('i8')
+    valid = (codes >= 0) & ~np.isnat(df[date_col].values)
+    m0 = months[valid].min() if valid.any() else 0
+    span = months[valid].max()-m0+1 if valid.any() else 1
+    g = grouping(codes.astype(np.int64)*span + (months-m0), mask=valid)
+
+    # Columns reduced in chunks, bounding the float64 copy to rows x chunk
+    stats = {}
+    for i in range(0,len(columns),chunk):
+      block = columns[i:i+chunk]
+      reduced = g.reduce(df[block].to_numpy(dtype=np.float64),cube_stats)
+      for j, c in enumerate(block):
+        stats[(c,'count')] = reduced['count'][:,j].astype(np.int32)
+        stats[(c,'mean')]  = reduced['mean'][:,j].astype(np.float32)
+        stats[(c,'std')]   = reduced['std'][:,j].astype(np.float32)
+
+    keys = np.asarray(g.labels,dtype=np.int64)
+    index = pd.MultiIndex.from_arrays(
+              [pd.Categorical.from_codes(keys//span,sites),
+               (keys%span + m0).astype('datetime64[M]').astype('datetime64[ns]')],
+              names=[site_col,month_col])
+    return pd.DataFrame(stats,index=index)
+
+  def site_names(self):
+    return list(self.offsets.keys())
+
+  def variables(self):
+    return list(dict.fromkeys([c for c, stat in self.table.columns]))
+
+  def stats(self,site,var):
+    start, stop = self.offsets.get(site,(0,0))
+    valid = self.columns[(var,'count')][start:stop] > 0
+    return pd.DataFrame({stat: self.columns[(var,stat)][start:stop][valid] for stat in cube_stats},
+                        index=self.months[start:stop][valid])
+
+  def monthly(self,site,var):
+    return self.stats(site,var)[['mean']].rename(columns={'mean':var})
+
+  def coords(self,site):
+    start, stop = self.offsets[site]
+    return float(self.columns[(lat_col,'mean')][start]), float(self.columns[(lon_col,'mean')][start])
+
+  def climatology(self,site,var,by='month'):
+    st = self.stats(site,var)
+    month = st.index.month
+    key = pd.Index(month if by == 'month' else month.map(seasons), name=by)
+
+    # Pooled over the months of each group: within-month and between-month sums of squares
+    n, m, s = [st[stat].to_numpy(dtype=float) for stat in cube_stats]
+    pooled = pd.DataFrame({'count':n, 'sum':n*m, 'ss':np.where(n > 1,(n-1)*s**2,0)},index=key)
+    pooled = pooled.groupby(level=0).sum()
+    pooled['mean'] = pooled['sum']/pooled['count']
+    between = pd.Series(n*(m-pooled['mean'].reindex(key).values)**2,index=key).groupby(level=0).sum()
+    pooled['std'] = np.sqrt((pooled['ss']+between)/(pooled['count']-1)).where(pooled['count'] > 1)
+
+    if by == 'season':
+      pooled = pooled.reindex([x for x in ['DJF','MAM','JJA','SON'] if x in pooled.index])
+    pooled['count'] = pooled['count'].astype(int)
+    return pooled[cube_stats]
+
+  def save(self,filename):
+    df = self.table.copy()
+    df.columns = ['{}_{}'.format(c,stat) for c, stat in df.columns]
+    save_df(df.reset_index(),filename)
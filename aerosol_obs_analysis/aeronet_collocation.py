@@ -0,0 +1,215 @@
+'''''
+
+Collocation of gridded model fields with the AERONET sites
+
+The grid cells and weights of every site are computed once (nearest
+cell, or the 4 cells around the site for bilinear interpolation), then
+the model values of all (site, date) records are gathered with one
+fancy index per block of model time steps.
+
+class model_field
+methods:
+  - __init__(values,lat,lon,time,name)
+    - values: (time, lat, lon) array (np.ndarray, np.memmap or a netCDF4 variable)
+    - lat, lon: 1-D cell centers, any order/convention (e.g. 0..360 or -180..180)
+    - time: dates of the time steps (daily or monthly means)
+
+class collocation
+methods:
+  - __init__(field,sites,method)
+    - sites: df of site lat/lon indexed by site name (aeronet.site_locator().coords())
+    - method: 'nearest' or 'bilinear'
+  - site_cells(site)           : return list of ((lat, lon) of the cell, weight)
+  - pairs(df,var,time_match)   : return df of AERONET_Site_Name, date, obs, model
+    - time_match: 'day' (model time step of that day) or 'month' (of that month)
+    - Records without a model time step or value are left out
+
+functions:
+  - read_field(filename,var,lat_name,lon_name,time_name) : return model_field
+    - .nc (requires netCDF4, values are read on use) or .npz with values, lat, lon, time
+  - pair_stats(pairs,by)     : return df of n, obs_mean, model_mean, bias, rmse, corr, nmb
+    - by: None (all pairs), 'site', 'month' or a column of pairs
+
+'''''
+import os
+import numpy as np
+import pandas as pd
+from .aeronet_aggregate import grouping
+
+site_col = 'AERONET_Site_Name'
+date_col = 'Date(dd:mm:yyyy)'
+lat_col  = 'Site_Latitude(Degrees)'
+lon_col  = 'Site_Longitude(Degrees)'
+
+# Model time steps read at once by collocation.pairs
+time_chunk = 64
+
+class model_field():
+
+  def __init__(self,values,lat,lon,time,name='model'):
+    self.values = values
+    self.lat  = np.asarray(lat,dtype=float)
+    self.lon  = np.asarray(lon,dtype=float)
+    self.time = pd.DatetimeIndex(time)
+    self.name = name
+    if tuple(values.shape) != (len(self.time),len(self.lat),len(self.lon)):
+      raise ValueError('values {} do not match (time, lat, lon) = {}'.format(
+        tuple(values.shape),(len(self.time),len(self.lat),len(self.lon))))
+
+def read_field(filename,var,lat_name='lat',lon_name='lon',time_name='time'):
+  if os.path.splitext(filename)[1] == '.npz':
+    data = np.load(filename)
+    return model_field(data['values'],data['lat'],data['lon'],data['time'],name=var)
+
+  # NetCDF is optional: netCDF4 is only needed for .nc fields
+  import netCDF4
+  nc = netCDF4.Dataset(filename)
+  times = nc.variables[time_name]
+  dates = netCDF4.num2date(times[:],times.units,getattr(times,'calendar','standard'),
+                           only_use_cftime_datetimes=False,only_use_python_datetimes=True)
+  return model_field(nc.variables[var],nc.variables[lat_name][:],nc.variables[lon_name][:],
+                     pd.DatetimeIndex(dates),name=var)
+
+def western_lon(lon):
+  # Longitude of the cell after the widest gap between the cells (the first cell of a regional grid)
+  rel = np.sort((lon-lon[0]) % 360)
+  gaps = np.diff(np.r_[rel,rel[0]+360])
+  start = (len(gaps)-np.argmax(gaps[::-1])) % len(rel)
+  return lon[0]+rel[start]
+
+def bracket(grid,x,periodic=False):
+  # Cells i0, i1 of the ascending grid around x and the weight t of i1
+  n = len(grid)
+  if n == 1:
+    zero = np.zeros(len(x),dtype=int)
+    return zero, zero, np.zeros(len(x))
+  if periodic:
+    ext = np.r_[grid, grid[0]+360]
+    i0 = np.clip(np.searchsorted(ext,x,side='right')-1,0,n-1)
+    return i0, (i0+1)%n, (x-ext[i0])/(ext[i0+1]-ext[i0])
+  i0 = np.clip(np.searchsorted(grid,x,side='right')-1,0,n-2)
+  return i0, i0+1, np.clip((x-grid[i0])/(grid[i0+1]-grid[i0]),0,1)
+
+class collocation():
+
+  def __init__(self,field,sites,method='nearest'):
+    self.field = field
+    self.sites = pd.Index(sites.index.astype(str),name=site_col)
+    self.method = method
+
+    # Latitudes ascending; longitudes as offsets from the first cell, periodic if the grid is global
+    lat_order = np.argsort(field.lat)
+    lat_sorted = field.lat[lat_order]
+    lon0 = western_lon(field.lon)
+    lon_rel = (field.lon-lon0) % 360
+    lon_order = np.argsort(lon_rel)
+    lon_sorted = lon_rel[lon_order]
+    step = np.median(np.diff(lon_sorted)) if len(lon_sorted) > 1 else 360
+    periodic = lon_sorted[-1]+step >= 360-1e-6
+
+    site_lat = sites[lat_col].to_numpy(dtype=float)
+    site_lon = (sites[lon_col].to_numpy(dtype=float)-lon0) % 360
+    if not periodic:
+      # Sites up to half a cell west of the first cell: negative offsets, clamped to it
+      site_lon = np.where(site_lon > 360-step/2,site_lon-360,site_lon)
+    y0, y1, ty = bracket(lat_sorted,site_lat)
+    x0, x1, tx = bracket(lon_sorted,site_lon,periodic)
+
+    # Sites more than half a cell outside a regional grid get no model value
+    half = lambda grid: (np.median(np.diff(grid)) if len(grid) > 1 else 180)/2
+    outside = (site_lat < lat_sorted[0]-half(lat_sorted)) | (site_lat > lat_sorted[-1]+half(lat_sorted))
+    if not periodic:
+      outside |= site_lon > lon_sorted[-1]+step/2
+
+    if method == 'nearest':
+      lat_idx = [np.where(ty < 0.5,y0,y1)]
+      lon_idx = [np.where(tx < 0.5,x0,x1)]
+      weights = [np.ones(len(sites))]
+    elif method == 'bilinear':
+      lat_idx = [y0,y0,y1,y1]
+      lon_idx = [x0,x1,x0,x1]
+      weights = [(1-ty)*(1-tx),(1-ty)*tx,ty*(1-tx),ty*tx]
+    else:
+      raise ValueError('method must be nearest or bilinear: {}'.format(method))
+
+    # Flat cell of the (lat, lon) plane in the order of field.values, (sites x k)
+    n_lon = len(field.lon)
+    self.cells = np.stack([lat_order[i]*n_lon + lon_order[j] for i, j in zip(lat_idx,lon_idx)],axis=1)
+    self.weights = np.stack(weights,axis=1)
+    self.weights[outside] = np.nan
+
+  def site_cells(self,site):
+    i = self.sites.get_loc(site)
+    n_lon = len(self.field.lon)
+    return [((self.field.lat[c//n_lon],self.field.lon[c%n_lon]),w)
+            for c, w in zip(self.cells[i],self.weights[i])]
+
+  def time_steps(self,dates,time_match='day'):
+    unit = {'day':'D','month':'M'}[time_match]
+    steps = pd.Index(self.field.time.values.astype('datetime64[{}]'.format(unit)))
+    if not steps.is_unique:
+      raise ValueError('Several model time steps in one {}'.format(time_match))
+    return steps.get_indexer(dates.astype('datetime64[{}]'.format(unit)))
+
+  def pairs(self,df,var='AOD_500nm',time_match='day'):
+    obs = df[var].to_numpy(dtype=np.float64)
+    site_idx = self.sites.get_indexer(df[site_col].astype(str))
+    t_idx = self.time_steps(df[date_col].values,time_match)
+    rows = np.flatnonzero((site_idx >= 0) & (t_idx >= 0) & ~np.isnan(obs))
+    rows = rows[np.argsort(t_idx[rows],kind='stable')]
+
+    model = np.full(len(rows),np.nan)
+    steps = np.unique(t_idx[rows])
+    bounds = np.searchsorted(t_idx[rows],steps[::time_chunk])
+    for k, start in enumerate(bounds):
+      stop = bounds[k+1] if k+1 < len(bounds) else len(rows)
+      block_steps = steps[k*time_chunk:(k+1)*time_chunk]
+      # (steps x cells) slab of the block, gathered for all its records at once
+      # (masked fill values of a netCDF4 variable as NaN)
+      block = np.ma.filled(np.ma.asarray(self.field.values[block_steps]).astype(np.float64),np.nan)
+      block = block.reshape(len(block_steps),-1)
+      r = rows[start:stop]
+      t = np.searchsorted(block_steps,t_idx[r])
+      values = block[t[:,None],self.cells[site_idx[r]]]
+      w = self.weights[site_idx[r]]
+      w = np.where(np.isnan(values),0,w)
+      with np.errstate(invalid='ignore',divide='ignore'):
+        model[start:stop] = np.nansum(values*w,axis=1)/w.sum(axis=1)
+
+    pairs = pd.DataFrame({site_col: df[site_col].values[rows],
+                          date_col: df[date_col].values[rows],
+                          'obs'   : obs[rows],
+                          'model' : model})
+    pairs = pairs[pairs['model'].notna().values]
+    return pairs.sort_values([site_col,date_col]).reset_index(drop=True)
+
+def pair_stats(pairs,by=None):
+  o = pairs['obs'].to_numpy(dtype=np.float64)
+  m = pairs['model'].to_numpy(dtype=np.float64)
+  if by is None:
+    keys = np.zeros(len(pairs),dtype=int)
+  elif by == 'site':
+    keys = pairs[site_col]
+  elif by == 'month':
+    keys = pd.Series(pairs[date_col].dt.month.values,name='month')
+  else:
+    keys = pairs[by]
+
+  # Sums of each group in one pass, then the statistics from the sums
+  g = grouping(keys)
+  s = g.reduce(np.column_stack([o,m,o*o,m*m,o*m,(m-o)**2]),['sum'])['sum']
+  n = g.size().astype(float)
+  with np.errstate(invalid='ignore',divide='ignore'):
+    o_mean, m_mean = s[:,0]/n, s[:,1]/n
+    cov   = s[:,4]/n - o_mean*m_mean
+    o_var = s[:,2]/n - o_mean**2
+    m_var = s[:,3]/n - m_mean**2
+    stats = pd.DataFrame({'n'         : n.astype(int),
+                          'obs_mean'  : o_mean,
+                          'model_mean': m_mean,
+                          'bias'      : m_mean-o_mean,
+                          'rmse'      : np.sqrt(s[:,5]/n),
+                          'corr'      : cov/np.sqrt(np.maximum(o_var,0)*np.maximum(m_var,0)),
+                          'nmb'       : (s[:,1]-s[:,0])/s[:,0]},
+                         index=g.labels)
+  return stats.iloc[0] if by is None else stats
@@ -0,0 +1,247 @@
+'''''
+
+Gridding of AERONET data on regular or model lat/lon grids
+
+The cell of every record is found once (searchsorted on the cell edges),
+then the count, mean and standard deviation of all columns are
+accumulated with np.bincount over the occupied (time slice, cell) keys,
+without a loop over cells. Only the occupied cells are kept; the dense
+(time, lat, lon) arrays are built on demand.
+
+class lat_lon_grid
+methods:
+  - __init__(grid_deg,lat,lon)   : regular grid_deg grid from (-90, -180), or the cell
+                                   centers lat, lon of a model grid (any order, 0..360 or -180..180)
+  - cells  (lat,lon)             : return flat cell index (lat x lon, in the order of self.lat/lon),
+                                   -1 outside a regional grid
+  - shape                        : (n_lat, n_lon)
+
+class grid_cube
+methods:
+  - __init__(df,columns,grid,time,site_mean)
+    - grid: grid_deg, lat_lon_grid, or an object with lat and lon (e.g. aeronet_collocation.model_field)
+    - time: 'month' (one slice per month) or None (one slice)
+    - site_mean=True averages the records of each site and slice first, each site then counts once
+      (count is then the number of site means)
+  - field  (var,stat)            : return (time, lat, lon) array of stat ('count','mean','std') or 'sites'
+  - slice  (var,month,stat)      : return (lat, lon) array of one month
+  - to_frame(var)                : return df of the occupied cells: time, lat, lon, count, mean, std, sites
+  - save   (filename)            : .npz (lat, lon, time and var_count/var_mean/var_std/sites arrays)
+                                   or .nc (requires netCDF4)
+  - nbytes                       : size of the kept arrays
+
+functions:
+  - bin_stats(keys,values,weights) : return occupied keys, {count, mean, std} (keys x columns)
+  - key_sites(keys,sites,labels)   : return number of distinct sites of each key in labels
+
+Cells without a valid value of a column have count 0 and NaN mean/std.
+
+'''''
+import os
+import numpy as np
+import pandas as pd
+
+site_col = 'AERONET_Site_Name'
+date_col = 'Date(dd:mm:yyyy)'
+lat_col  = 'Site_Latitude(Degrees)'
+lon_col  = 'Site_Longitude(Degrees)'
+
+grid_stats = ['count','mean','std']
+
+def bin_stats(keys,values,weights=None):
+  # Compact codes of the occupied keys, then one bincount per column and sum
+  labels, codes = np.unique(keys,return_inverse=True)
+  values = np.asarray(values,dtype=np.float64)
+  if values.ndim == 1:
+    values = values[:,None]
+  n = len(labels)
+  w = np.ones(len(codes)) if weights is None else np.asarray(weights,dtype=np.float64)
+
+  stats = {stat: np.zeros((n,values.shape[1])) for stat in grid_stats}
+  for j in range(values.shape[1]):
+    v = values[:,j]
+    finite = ~np.isnan(v)
+    c, wf = codes[finite], w[finite]
+    count = np.bincount(c,weights=wf,minlength=n)
+    with np.errstate(invalid='ignore',divide='ignore'):
+      mean = np.bincount(c,weights=wf*v[finite],minlength=n)/count
+      # Two-pass variance, ddof=1 as pandas
+      ss = np.bincount(c,weights=wf*(v[finite]-mean[c])**2,minlength=n)
+      std = np.sqrt(ss/(count-1))
+    std[count < 2] = np.nan
+    stats['count'][:,j], stats['mean'][:,j], stats['std'][:,j] = count, mean, std
+  return labels, stats
+
+def key_sites(keys,sites,labels):
+  # Distinct (key, site) pairs, counted by key
+  pairs = np.unique(np.column_stack([keys,pd.factorize(sites)[0]]),axis=0)[:,0]
+  return np.bincount(np.searchsorted(labels,pairs),minlength=len(labels))
+
+def cell_edges(centers):
+  # Edges halfway between the sorted centers, the outer ones half a cell out
+  if len(centers) == 1:
+    return np.array([centers[0]-180,centers[0]+180])
+  mid = (centers[1:]+centers[:-1])/2
+  return np.r_[2*centers[0]-mid[0], mid, 2*centers[-1]-mid[-1]]
+
+def as_grid(grid):
+  if isinstance(grid,lat_lon_grid):
+    return grid
+  if hasattr(grid,'lat') and hasattr(grid,'lon'):
+    return lat_lon_grid(lat=grid.lat,lon=grid.lon)
+  return lat_lon_grid(grid_deg=grid)
+
+class lat_lon_grid():
+
+  def __init__(self,grid_deg=None,lat=None,lon=None):
+    if grid_deg is not None:
+      lat = -90+(np.arange(int(np.ceil(180/grid_deg)))+0.5)*grid_deg
+      lon = -180+(np.arange(int(np.ceil(360/grid_deg)))+0.5)*grid_deg
+    self.grid_deg = grid_deg
+    self.lat = np.asarray(lat,dtype=float)
+    self.lon = np.asarray(lon,dtype=float)
+    self.shape = (len(self.lat),len(self.lon))
+
+    self.lat_order = np.argsort(self.lat)
+    self.lat_edges = cell_edges(self.lat[self.lat_order])
+
+    # Longitudes from the first sorted center, periodic if the cells cover 360 degrees
+    lon_rel = (self.lon-self.lon[0]) % 360
+    self.lon_order = np.argsort(lon_rel)
+    self.lon_edges = cell_edges(lon_rel[self.lon_order]) + self.lon[0]
+    self.periodic = self.lon_edges[-1]-self.lon_edges[0] >= 360-1e-6
+    if self.periodic:
+      self.lon_edges[-1] = self.lon_edges[0]+360
+
+  def cells(self,lat,lon):
+    lat = np.asarray(lat,dtype=float)
+    lon = (np.asarray(lon,dtype=float)-self.lon_edges[0]) % 360 + self.lon_edges[0]
+    n_lat, n_lon = self.shape
+    i = np.searchsorted(self.lat_edges,lat,side='right')-1
+    j = np.searchsorted(self.lon_edges,lon,side='right')-1
+    if self.grid_deg is not None:
+      # Last cells of a grid_deg not dividing 180/360 take the points up to the poles/dateline
+      i = np.clip(i,0,n_lat-1)
+      j = np.clip(j,0,n_lon-1)
+    inside = (i >= 0) & (i < n_lat) & (j >= 0) & (j < n_lon) & ~np.isnan(lat) & ~np.isnan(lon)
+    cell = self.lat_order[np.clip(i,0,n_lat-1)]*n_lon + self.lon_order[np.clip(j,0,n_lon-1)]
+    return np.where(inside,cell,-1)
+
+class grid_cube():
+
+  def __init__(self,df,columns=['AOD_500nm'],grid=1.0,time='month',site_mean=False,chunk=16):
+    self.grid = as_grid(grid)
+    self.columns = list(columns)
+    n_cells = self.grid.shape[0]*self.grid.shape[1]
+
+    cell = self.grid.cells(df[lat_col].to_numpy(dtype=float),df[lon_col].to_numpy(dtype=float))
+    dates = df[date_col].values
+    if time == 'month':
+      months = dates.astype('datetime64[M]').view('i8')
+      valid = (cell >= 0) & ~np.isnat(dates)
+      m0 = months[valid].min() if valid.any() else 0
+      span = months[valid].max()-m0+1 if valid.any() else 1
+      slot = months-m0
+      self.time = pd.DatetimeIndex((np.arange(span)+m0).astype('datetime64[M]').astype('datetime64[ns]'),name='time')
+    elif time is None:
+      valid = cell >= 0
+      slot = np.zeros(len(df),dtype=np.int64)
+      start = dates[valid & ~np.isnat(dates)].min() if valid.any() else np.datetime64('NaT')
+      self.time = pd.DatetimeIndex([start],name='time')
+    else:
+      raise ValueError('time must be month or None: {}'.format(time))
+    rows = np.flatnonzero(valid)
+    keys = slot[rows]*n_cells + cell[rows]
+    sites = df[site_col].to_numpy()[rows]
+
+    cell_keys = keys
+    if site_mean:
+      # Site means of each slice first (a site is in a single cell), each then counts once in the cell
+      pairs, site_keys = np.unique(np.column_stack([keys,pd.factorize(sites)[0]]),axis=0,return_inverse=True)
+      site_keys = site_keys.ravel()
+      cell_keys = pairs[:,0]
+
+    self.stats = {}
+    for i in range(0,len(self.columns),chunk):
+      block = self.columns[i:i+chunk]
+      values = df[block].to_numpy(dtype=np.float64)[rows]
+      if site_mean:
+        values = bin_stats(site_keys,values)[1]['mean']
+      labels, stats = bin_stats(cell_keys,values)
+      for j, c in enumerate(block):
+        self.stats[c] = {'count': stats['count'][:,j].astype(np.int32),
+                         'mean' : stats['mean'][:,j].astype(np.float32),
+                         'std'  : stats['std'][:,j].astype(np.float32)}
+    self.keys = np.unique(keys)
+    self.sites = key_sites(keys,sites,self.keys).astype(np.int32)
+    self.n_cells = n_cells
+
+  @property
+  def nbytes(self):
+    return self.keys.nbytes + self.sites.nbytes + \
+           sum([a.nbytes for stats in self.stats.values() for a in stats.values()])
+
+  def field(self,var,stat='mean'):
+    if stat == 'sites':
+      values, fill, dtype = self.sites, 0, np.int32
+    else:
+      values = self.stats[var][stat]
+      fill, dtype = (0, np.int32) if stat == 'count' else (np.nan, np.float32)
+    dense = np.full(len(self.time)*self.n_cells,fill,dtype=dtype)
+    dense[self.keys] = values
+    return dense.reshape(len(self.time),*self.grid.shape)
+
+  def slice(self,var,month,stat='mean'):
+    t = self.time.get_loc(pd.Timestamp(month).to_period('M').to_timestamp()) if len(self.time) > 1 else 0
+    start = np.searchsorted(self.keys,t*self.n_cells)
+    stop = np.searchsorted(self.keys,(t+1)*self.n_cells)
+    values = self.sites if stat == 'sites' else self.stats[var][stat]
+    dense = np.full(self.n_cells,0 if stat in ['count','sites'] else np.nan,dtype=values.dtype)
+    dense[self.keys[start:stop]-t*self.n_cells] = values[start:stop]
+    return dense.reshape(self.grid.shape)
+
+  def to_frame(self,var):
+    t, cell = np.divmod(self.keys,self.n_cells)
+    n_lon = self.grid.shape[1]
+    df = pd.DataFrame({'time' : self.time[t],
+                       'lat'  : self.grid.lat[cell//n_lon],
+                       'lon'  : self.grid.lon[cell%n_lon],
+                       'count': self.stats[var]['count'],
+                       'mean' : self.stats[var]['mean'],
+                       'std'  : self.stats[var]['std'],
+                       'sites': self.sites})
+    return df[df['count'].values > 0].reset_index(drop=True)
+
+  def save(self,filename):
+    if os.path.splitext(filename)[1] == '.nc':
+      return self.save_nc(filename)
+    arrays = {'lat':self.grid.lat, 'lon':self.grid.lon, 'time':self.time.values,
+              'sites':self.field(None,'sites')}
+    for c in self.columns:
+      for stat in grid_stats:
+        arrays['{}_{}'.format(c,stat)] = self.field(c,stat)
+    np.savez_compressed(filename,**arrays)
+    print('Grid cube saved as {}'.format(filename))
+
+  def save_nc(self,filename):
+    # NetCDF is optional: netCDF4 is only needed for .nc files
+    import netCDF4
+    with netCDF4.Dataset(filename,'w') as nc:
+      nc.createDimension('time',len(self.time))
+      nc.createDimension('lat',self.grid.shape[0])
+      nc.createDimension('lon',self.grid.shape[1])
+      times = nc.createVariable('time','f8',('time',))
+      times.units = 'days since 1970-01-01'
+      times[:] = (self.time.values-np.datetime64('1970-01-01','ns'))/np.timedelta64(1,'D')
+      nc.createVariable('lat','f8',('lat',))[:] = self.grid.lat
+      nc.createVariable('lon','f8',('lon',))[:] = self.grid.lon
+      sites = nc.createVariable('sites','i4',('time','lat','lon'),zlib=True)
+      sites[:] = self.field(None,'sites')
+      for c in self.columns:
+        for stat in grid_stats:
+          dtype, fill = ('i4',None) if stat == 'count' else ('f4',np.float32(np.nan))
+          v = nc.createVariable('{}_{}'.format(c,stat).replace('/','_'),dtype,('time','lat','lon'),
+                                zlib=True,fill_value=fill)
+          v.long_name = '{} of {}'.format(stat,c)
+          v[:] = self.field(c,stat)
+    print('Grid cube saved as {}'.format(filename))
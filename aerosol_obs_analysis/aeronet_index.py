@@ -0,0 +1,127 @@
+'''''
+
+Site/date index of an AERONET DataFrame
+
+Built once per DataFrame (aeronet.site_index()), so that selecting one
+site or one time window costs about the size of the selection instead of
+a boolean scan of the whole table.
+
+class site_date_index
+methods:
+  - __init__(df)
+  - rows      (site,time_range) : return positions of the site rows
+  - time_rows (time_range)      : return positions of the rows in time_range
+  - site_names()                : return list_of_site_names
+
+Positions are sorted, so df.iloc[positions] keeps the row order of df.
+time_range is the open interval used by aeronet.filter_time.
+
+functions:
+  - site_date_keys(df,sites,day0,span) : return int64 key per row
+    - site position in sites * span + days since day0, -1 if the site or date is missing
+  - join_site_date(left,right,on)      : return df, None if (site, date) is not unique
+    - Outer join on the integer keys, rows sorted by (site, date)
+    - Columns of on other than site and date (e.g. lat/lon) are taken from
+      left, from right for the rows only in right
+
+'''''
+import numpy as np
+import pandas as pd
+
+site_col = 'AERONET_Site_Name'
+date_col = 'Date(dd:mm:yyyy)'
+
+def to_ns(t):
+  return pd.Timestamp(t).value
+
+class site_date_index():
+
+  def __init__(self,df):
+    codes, sites = pd.factorize(df[site_col], sort=True)
+    dates = df[date_col].values.astype('datetime64[ns]').view('i8')
+
+    # Rows sorted by (site, date) and the offsets of each site in that order
+    self.order = np.lexsort((dates,codes))
+    self.site_dates = dates[self.order]
+    sorted_codes = codes[self.order]
+    starts = np.searchsorted(sorted_codes, np.arange(len(sites)), side='left')
+    stops  = np.searchsorted(sorted_codes, np.arange(len(sites)), side='right')
+    self.offsets = {site:(start,stop) for site,start,stop in zip(np.asarray(sites),starts,stops)}
+
+    # Rows sorted by date only
+    self.date_order = np.argsort(dates, kind='stable')
+    self.dates = dates[self.date_order]
+
+  def site_names(self):
+    return list(self.offsets.keys())
+
+  def rows(self,site,time_range=None):
+    start, stop = self.offsets.get(site,(0,0))
+    if time_range:
+      dates = self.site_dates[start:stop]
+      start, stop = (start + np.searchsorted(dates, to_ns(time_range[0]), side='right'),
+                     start + np.searchsorted(dates, to_ns(time_range[1]), side='left'))
+    return np.sort(self.order[start:max(start,stop)])
+
+  def time_rows(self,time_range):
+    start = np.searchsorted(self.dates, to_ns(time_range[0]), side='right')
+    stop  = np.searchsorted(self.dates, to_ns(time_range[1]), side='left')
+    return np.sort(self.date_order[start:max(start,stop)])
+
+def site_date_keys(df,sites,day0,span):
+  codes = pd.Categorical(df[site_col],categories=sites).codes.astype(np.int64)
+  days = df[date_col].values.astype('datetime64[D]').view('i8')
+  keys = codes*span + (days-day0)
+  keys[(codes < 0) | np.isnat(df[date_col].values)] = -1
+  return keys
+
+def join_site_date(left,right,on):
+  sites = pd.Index(np.union1d(np.asarray(left[site_col].unique()).astype(str),
+                              np.asarray(right[site_col].unique()).astype(str)))
+  days = np.r_[left[date_col].values, right[date_col].values].astype('datetime64[D]')
+  days = days[~np.isnat(days)].view('i8')
+  if len(days) == 0:
+    return None
+  day0, span = days.min(), days.max()-days.min()+1
+
+  k_left  = site_date_keys(left,sites,day0,span)
+  k_right = site_date_keys(right,sites,day0,span)
+  # Sorted union of the keys and the position of each input row in it.
+  # Inputs read site by site are two sorted runs, which the stable sort merges
+  keys, inverse = np.unique(np.r_[k_left,k_right], return_inverse=True)
+  n = len(keys)
+  pos_left, pos_right = inverse[:len(k_left)], inverse[len(k_left):]
+  if n and keys[0] < 0:
+    return None
+  for pos in [pos_left,pos_right]:
+    if len(pos) and np.bincount(pos,minlength=n).max() > 1:
+      return None
+
+  result = {site_col: pd.Categorical.from_codes(keys//span,sites).remove_unused_categories(),
+            date_col: (keys%span + day0).astype('datetime64[D]').astype('datetime64[ns]')}
+  for c in on:
+    if c not in result:
+      values = np.empty(n,dtype=left[c].dtype)
+      values[pos_right] = right[c].values
+      values[pos_left]  = left[c].values
+      result[c] = values
+
+  for df, pos in [(left,pos_left),(right,pos_right)]:
+    columns = df.columns.drop(on)
+    # Float columns of a dtype are the rows of one (columns x n) array, so a run of
+    # them (e.g. the Bin columns, df.dvdlnr.values) stays evenly spaced in memory
+    rows = {}
+    for dtype in set([df[c].dtype for c in columns if df[c].dtype.kind == 'f']):
+      same = [c for c in columns if df[c].dtype == dtype]
+      rows.update(zip(same,np.full((len(same),n),np.nan,dtype=dtype)))
+    for c in columns:
+      values = df[c].values
+      if c in rows:
+        result[c] = rows[c]
+        result[c][pos] = values
+      else:
+        result[c] = pd.Series(values,index=pos).reindex(np.arange(n)).values
+
+  # Columns in the order of pd.merge, kept as 1-D blocks (not consolidated, no copy)
+  columns = list(on)+[c for c in result if c not in on]
+  return pd.DataFrame({c:result[c] for c in columns},copy=False)
@@ -0,0 +1,152 @@
+'''''
+
+Memory-mapped store of AERONET DataFrames
+
+A .mmap store is a directory with one .npy file per column and a small
+index (meta.json): the rows are sorted by (site, date) and the offsets of
+each site's rows are kept. The arrays are opened with np.load(mmap_mode='r'),
+so any number of processes reading the same store share the pages of the
+OS file cache instead of holding one copy of the table each.
+
+Numeric and bool columns are stored as they are (float32 measurements
+stay float32), dates as int64 nanoseconds, site names and other text
+columns as category codes (int8/int16/..., as pandas) with their
+categories in meta.json.
+
+class mmap_store
+methods:
+  - __init__(path)                         : opens the index, the arrays are mapped on use
+  - array  (column)                        : return the read-only memory-mapped array
+  - rows   (sites,time_range)              : return slice or positions of the rows
+    - all rows or one site: a slice; time_range is the open interval of aeronet.filter_time
+  - frame  (columns,sites,time_range)      : return df, index the row positions in the store
+    - For a slice of rows (all rows, one site) the columns are views of the mapped arrays
+      (no copy, read-only), other selections copy only the selected rows
+  - site_names()                           : return list_of_site_names
+  - n_rows
+
+functions:
+  - write_mmap(df,path) : save df as a .mmap store (replaces path)
+
+An mmap_store is pickled as its path, so a process pool worker opens the
+store itself instead of receiving a copy of the data.
+
+'''''
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+site_col = 'AERONET_Site_Name'
+date_col = 'Date(dd:mm:yyyy)'
+meta_name = 'meta.json'
+
+def column_file(i):
+  # Column names have '/' and brackets, the files are numbered
+  return 'c{:04d}.npy'.format(i)
+
+def write_mmap(df,path):
+  df = df.drop(columns=['dV/dlnr'], errors='ignore')
+  codes, sites = pd.factorize(df[site_col], sort=True)
+  dates = df[date_col].values.astype('datetime64[ns]').view('i8')
+  order = np.lexsort((dates,codes))
+  sorted_codes = codes[order]
+  starts = np.searchsorted(sorted_codes, np.arange(len(sites)), side='left')
+  stops  = np.searchsorted(sorted_codes, np.arange(len(sites)), side='right')
+
+  # Written next to path, then moved in place
+  tmp = path.rstrip('/')+'.tmp'
+  if os.path.exists(tmp):
+    shutil.rmtree(tmp)
+  os.makedirs(tmp)
+  columns = []
+  for i, c in enumerate(df.columns):
+    s = df[c]
+    entry = {'name':c, 'file':column_file(i)}
+    if s.dtype.kind in 'biuf':
+      entry['kind'] = 'numeric'
+      values = s.to_numpy()
+    elif s.dtype.kind == 'M':
+      entry['kind'] = 'datetime'
+      values = s.values.astype('datetime64[ns]').view('i8')
+    else:
+      cat = s.astype('category').cat
+      entry['kind'] = 'category'
+      entry['categories'] = [str(x) for x in cat.categories]
+      values = cat.codes.to_numpy()
+    np.save(os.path.join(tmp,entry['file']), np.ascontiguousarray(values[order]))
+    columns.append(entry)
+
+  meta = {'n_rows' : len(df),
+          'columns': columns,
+          'sites'  : [str(site) for site in sites],
+          'offsets': [[int(start),int(stop)] for start,stop in zip(starts,stops)]}
+  with open(os.path.join(tmp,meta_name),'w') as f:
+    json.dump(meta,f)
+
+  if os.path.exists(path):
+    shutil.rmtree(path)
+  os.rename(tmp,path)
+
+def to_ns(t):
+  return pd.Timestamp(t).value
+
+class mmap_store():
+
+  def __init__(self,path):
+    self.path = path
+    with open(os.path.join(path,meta_name)) as f:
+      meta = json.load(f)
+    self.n_rows = meta['n_rows']
+    self.columns = {entry['name']: entry for entry in meta['columns']}
+    self.offsets = {site:tuple(offset) for site, offset in zip(meta['sites'],meta['offsets'])}
+    self.arrays = {}
+
+  def __reduce__(self):
+    return (mmap_store,(self.path,))
+
+  def site_names(self):
+    return list(self.offsets.keys())
+
+  def array(self,column):
+    if column not in self.arrays:
+      self.arrays[column] = np.load(os.path.join(self.path,self.columns[column]['file']),mmap_mode='r')
+    return self.arrays[column]
+
+  def rows(self,sites=None,time_range=None):
+    if sites is None:
+      rows = slice(0,self.n_rows)
+      if time_range:
+        dates = self.array(date_col)
+        rows = np.flatnonzero((dates > to_ns(time_range[0])) & (dates < to_ns(time_range[1])))
+      return rows
+
+    # Rows of each site are contiguous and sorted by date
+    ranges = []
+    for site in sites:
+      start, stop = self.offsets.get(site,(0,0))
+      if time_range:
+        dates = self.array(date_col)[start:stop]
+        start, stop = (start + np.searchsorted(dates, to_ns(time_range[0]), side='right'),
+                       start + np.searchsorted(dates, to_ns(time_range[1]), side='left'))
+      ranges.append((start,max(start,stop)))
+    if len(ranges) == 1:
+      return slice(*ranges[0])
+    return np.sort(np.concatenate([np.arange(start,stop) for start,stop in ranges] or [np.zeros(0,dtype=int)]))
+
+  def column(self,column,rows):
+    entry = self.columns[column]
+    values = self.array(column)[rows]
+    if entry['kind'] == 'datetime':
+      return values.view('datetime64[ns]')
+    if entry['kind'] == 'category':
+      return pd.Categorical.from_codes(values,categories=entry['categories'])
+    return values
+
+  def frame(self,columns=None,sites=None,time_range=None):
+    rows = self.rows(sites,time_range)
+    index = pd.RangeIndex(rows.start,rows.stop) if isinstance(rows,slice) else pd.Index(rows)
+    columns = list(self.columns) if columns is None else list(columns)
+    # One block per column (copy=False), so pandas does not consolidate the views into a copy
+    return pd.DataFrame({c: self.column(c,rows) for c in columns},index=index,copy=False)
@@ -0,0 +1,151 @@
+'''''
+
+Non-interactive pipeline for the aeronet loader
+
+  load AOD/INV -> skim -> combine -> filter time -> filter site -> save
+
+Configured by a dict or a JSON file, no input() prompts. Each stage is
+timed and the timings are printed at the end (pipeline.timings).
+
+class aeronet_pipeline
+methods:
+  - __init__(config,aeronet_data) : config dict or JSON file name, aeronet object (created if None)
+  - run()                         : return aeronet (df_aod_all, df_inv_all, df)
+  - report()                      : return df of stage timings
+
+config (keys not given take the defaults below):
+  pickle_path : work directory of the stored files
+  n_workers   : processes to parse the raw site files
+  aod, inv    : source of the all-sites data, None to skip (one of them is required)
+                {'file': name}                       stored file in pickle_path (.parquet/.feather/.pkl)
+                {'raw': directory}                   raw daily site files
+                {'tar': file, 'member_path': dir}    raw site files inside a .tar(.gz)
+                raw sources also take 'skim' (default True) and 'save' (file name)
+  combine     : combine AOD and INV
+  time_range  : [start, end] as dates or 'YYYY-MM-DD', None for all
+  site        : AERONET_Site_Name, None for all (KeyError if the site has no data)
+  save        : file name of the result in pickle_path, None to not save
+  monthly_cube: also save the site x month cube of the result next to it (aeronet_climatology)
+  profile     : file name of a JSON trace of the aeronet methods called (aeronet_profile), None for no trace
+  profile_memory: also record the heap peak of each method in the trace (slower)
+
+Usage:
+  python -m aerosol_obs_analysis.aeronet_pipeline config.json
+
+'''''
+import sys
+import json
+import time
+import pandas as pd
+
+from .aeronet_analysis import aeronet, pickle_path
+from .aeronet_store import read_df, save_df
+from .aeronet_profile import profiler
+
+default_config = {'pickle_path' : pickle_path,
+                  'n_workers'   : 1,
+                  'aod'         : None,
+                  'inv'         : None,
+                  'combine'     : True,
+                  'time_range'  : None,
+                  'site'        : None,
+                  'save'        : None,
+                  'monthly_cube': False,
+                  'profile'     : None,
+                  'profile_memory': False}
+
+def load_config(filename):
+  with open(filename) as f:
+    return json.load(f)
+
+class aeronet_pipeline():
+
+  def __init__(self,config,aeronet_data=None):
+    if isinstance(config,str):
+      config = load_config(config)
+    self.config = {**default_config,**config}
+    if not (self.config['aod'] or self.config['inv']):
+      raise ValueError('config: no data source, aod or inv is required')
+    self.aeronet = aeronet_data or aeronet(pickle_path=self.config['pickle_path'])
+    self.timings = []
+
+  def stage(self,name,func,*args,**kwargs):
+    print('\n#### {} ####'.format(name))
+    t0 = time.perf_counter()
+    result = func(*args,**kwargs)
+    t = time.perf_counter()-t0
+
+    df = result[0] if isinstance(result,tuple) else result
+    rows = len(df) if isinstance(df,pd.DataFrame) else None
+    self.timings.append({'stage':name, 'time_s':t, 'rows':rows})
+    print('{}: {:.2f} s{}'.format(name,t,'' if rows is None else ', {} rows'.format(rows)))
+    return result
+
+  def report(self):
+    return pd.DataFrame(self.timings).set_index('stage')
+
+  def run(self):
+    config, data = self.config, self.aeronet
+    path = data.pickle_path
+    if config['profile']:
+      profiler.reset()
+      profiler.enable(memory=config['profile_memory'])
+
+    for data_name in ['AOD','INV']:
+      source = config[data_name.lower()]
+      if source:
+        df = self.load(data_name,source)
+        setattr(data,'df_{}_all'.format(data_name.lower()),df)
+
+    if config['combine'] and config['aod'] and config['inv']:
+      data.df = self.stage('combine',data.combine_df)
+    else:
+      data.df = data.df_aod_all if config['aod'] else data.df_inv_all
+
+    if config['time_range']:
+      time_range = [pd.Timestamp(t) for t in config['time_range']]
+      data.time_range = time_range
+      data.df = self.stage('filter time',data.filter_time,data.df,time_range)
+
+    if config['site']:
+      data.df, site_name = self.stage('filter site',data.filter_site,data.df,config['site'])
+
+    if config['save']:
+      self.stage('save',save_df,data.df,path+config['save'])
+      print('Saved as {}'.format(path+config['save']))
+      if config['monthly_cube']:
+        self.stage('monthly cube',data.save_monthly_cube,config['save'])
+
+    print('\n#### Pipeline timings ####')
+    print(self.report())
+    if config['profile']:
+      profiler.disable()
+      print(profiler.summary())
+      profiler.to_json(path+config['profile'])
+
+    return data
+
+  def load(self,data_name,source):
+    data = self.aeronet
+    path = data.pickle_path
+
+    if 'file' in source:
+      return self.stage('load {}'.format(data_name),read_df,path+source['file'])
+
+    n_workers = self.config['n_workers']
+    if 'tar' in source:
+      df = self.stage('load {}'.format(data_name),data.read_daily_tar,
+                      source['tar'],source.get('member_path',''),n_workers=n_workers)
+    else:
+      df = self.stage('load {}'.format(data_name),data.read_daily_files,
+                      source['raw'],n_workers=n_workers)
+
+    if source.get('skim',True):
+      df = self.stage('skim {}'.format(data_name),data.skim_daily,df,data_name)
+    if source.get('save'):
+      self.stage('save {}'.format(data_name),save_df,df,path+source['save'])
+
+    return df
+
+if __name__ == '__main__':
+  aeronet_pipeline(sys.argv[1]).run()
@@ -4,6 +4,12 @@ Plotting tool for AERONET data and model results
 
 Functions:
 - plot_var_map_interactive
+- plot_var_map_gl(var,min_rec,grid_deg,zoom,daily,time_range,show) : return fig
+  - WebGL map (Scattermap) of the site means (daily=False) or the daily records
+    (daily=True), averaged on a grid_deg lat/lon grid (aeronet_grid) when given; zoom sets
+    grid_deg from the map zoom level (about 8 pixels a cell)
+  - Hover text from customdata and a hovertemplate, the payload size is printed
+  - The layers are cached by aeronet.cached until aeronet.df changes
 - plot_single_site
 
 '''''
@@ -20,6 +26,9 @@ import plotly.graph_objs as go
 
 import datetime
 
+from .aeronet_grid import lat_lon_grid, bin_stats, key_sites
+from .aeronet_profile import profiled
+
 # Output directory
 save_path = 'workspace/plot_output'
 
@@ -50,8 +59,11 @@ colors['cmap2'] = ['#A000C8','#8200DC','#1E3CFF','#00A0FF','#00C8C8','#00D28C',
                   '#00DC00','#A0E632','#E6DC32','#E6AF2D','#F08228','#FA3C3C','#F00082']
 boundaries['cmap2'] = [0.05,0.1,0.15,0.2,0.25,0.3,0.35,0.4,0.45,0.5,0.55,0.6]
 
+# Grid of the map at zoom level 0: 8 pixels of a 256-pixel world tile
+zoom0_grid_deg = 360/32
+
 for key in colors.keys():
-  cmaps[key] = matplotlib.colors .ListedColormap(colors[key][1:-1])
+  cmaps[key] = mpl.colors.ListedColormap(colors[key][1:-1])
   cmaps[key].set_under(colors[key][0])
   cmaps[key].set_over(colors[key][-1])
 
@@ -72,6 +84,7 @@ class plot_aeronet():
 
 ### Plotting: AERONET  ###
 
+  @profiled
   def plot_var_map_interactive(self, var='aod',min_rec=0,dtick=0.1):
 
 
@@ -90,7 +103,7 @@ class plot_aeronet():
     data = [go.Scattergeo(
         lat = lats,
         lon = lons,
-        text = df_ave.index.values + ' ('+[str(d) for d in df_ave[var_name].values] +')',
+        text = df_ave.index.astype(str) + ' (' + df_ave[var_name].astype(str) + ')',
         marker = dict(
             color = df_ave[var_name],
             colorscale = 'Rainbow',
@@ -99,7 +112,7 @@ class plot_aeronet():
             size = 7,
             colorbar = dict(
                 thickness = 30,
-                titleside = "right",
+                title = dict(side="right"),
                 outlinecolor = "rgba(68, 68, 68, 0)",
                 ticks = "outside",
                 ticklen = 2,
@@ -138,3 +151,92 @@ class plot_aeronet():
     py.offline.iplot(fig)
     return
 
+  @profiled
+  def map_layer(self,var_name,min_rec=0,grid_deg=None,daily=False,time_range=None):
+    # Points of the map: columns lat, lon, value, count (records), sites, name
+    aeronet = self.aeronet
+    if daily:
+      rows = aeronet.site_index().time_rows(time_range) if time_range else slice(None)
+      df = aeronet.df.iloc[rows]
+      df = df[df[var_name].notna().values]
+      points = pd.DataFrame({'lat'  : df['Site_Latitude(Degrees)'].to_numpy(dtype=float),
+                             'lon'  : df['Site_Longitude(Degrees)'].to_numpy(dtype=float),
+                             'value': df[var_name].to_numpy(dtype=float),
+                             'count': 1,
+                             'sites': 1,
+                             'name' : df['AERONET_Site_Name'].astype(str).to_numpy()})
+    else:
+      df_ave = aeronet.cal_average(columns=[var_name],min_rec=min_rec)
+      points = pd.DataFrame({'lat'  : df_ave['Site_Latitude(Degrees)'].to_numpy(dtype=float),
+                             'lon'  : df_ave['Site_Longitude(Degrees)'].to_numpy(dtype=float),
+                             'value': df_ave[var_name].to_numpy(dtype=float),
+                             'count': df_ave['Record_number'].to_numpy(),
+                             'sites': 1,
+                             'name' : df_ave.index.astype(str)})
+
+    if not grid_deg or len(points) == 0:
+      return points
+
+    # Cell of each point, values averaged over the records in the cell, placed at the cell center
+    grid = lat_lon_grid(grid_deg)
+    cell = grid.cells(points['lat'].to_numpy(),points['lon'].to_numpy())
+    cells, stats = bin_stats(cell,points['value'].to_numpy(),weights=points['count'].to_numpy())
+    n_lon = grid.shape[1]
+    return pd.DataFrame({'lat'  : grid.lat[cells//n_lon],
+                         'lon'  : grid.lon[cells%n_lon],
+                         'value': stats['mean'][:,0],
+                         'count': stats['count'][:,0].astype(int),
+                         'sites': key_sites(cell,points['name'].to_numpy(),cells),
+                         'name' : 'Cell {:g} deg'.format(grid_deg)})
+
+  @profiled
+  def plot_var_map_gl(self, var='aod',min_rec=0,grid_deg=None,zoom=None,
+                      daily=False,time_range=None,show=True,dtick=0.1):
+    try:
+      var_name = self.aeronet.col_names[var]
+    except:
+      var_name = var
+    if zoom is not None and grid_deg is None:
+      grid_deg = zoom0_grid_deg/2**zoom
+
+    args = [var_name,min_rec,grid_deg,daily,time_range]
+    layer = self.aeronet.cached('map_layer',args,lambda: self.map_layer(*args))
+
+    customdata = np.column_stack([layer['count'].to_numpy(),layer['sites'].to_numpy()])
+    hover = ('%{text}<br>'+var_name+': %{marker.color:.3f}'
+             '<br>records: %{customdata[0]}, sites: %{customdata[1]}<extra></extra>')
+    # WebGL trace, numpy arrays are sent as typed arrays
+    trace = go.Scattermap(
+        lat = layer['lat'].to_numpy(dtype=np.float32),
+        lon = layer['lon'].to_numpy(dtype=np.float32),
+        mode = 'markers',
+        text = layer['name'].to_numpy(),
+        customdata = customdata.astype(np.int32),
+        hovertemplate = hover,
+        marker = dict(
+            color = layer['value'].to_numpy(dtype=np.float32),
+            colorscale = 'Rainbow',
+            opacity = 0.7,
+            size = 7,
+            colorbar = dict(thickness=30, title=dict(side="right"),
+                            ticks="outside", ticklen=2, dtick=dtick)
+        )
+    )
+
+    layout = go.Layout(
+        autosize=False,
+        width=600,
+        height=300,
+        margin=go.layout.Margin(l=0,r=0,b=0,t=40,pad=4),
+        map=dict(style='carto-positron',zoom=zoom or 0),
+        title=var_name
+    )
+
+    fig = go.Figure(data=[trace], layout=layout)
+    payload = len(fig.to_json())
+    print('{} points ({}), payload {:.1f} kB'.format(len(layer),
+          'grid {:g} deg'.format(grid_deg) if grid_deg else 'no grid',payload/1e3))
+    if show:
+      py.offline.init_notebook_mode(connected=True)
+      py.offline.iplot(fig)
+    return fig
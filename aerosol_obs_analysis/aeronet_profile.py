@@ -0,0 +1,165 @@
+'''''
+
+Stage profiling of the aeronet workflow
+
+The methods of aeronet, aeronet_single_site and the plotting classes
+decorated with @profiled are recorded as stages while the profiler is
+enabled: wall time, rows in (the DataFrame argument, else aeronet.df),
+rows out and memory of the returned DataFrame, and with memory=True the
+peak of the Python heap (tracemalloc) during the stage. Disabled, a
+decorated method costs one attribute test.
+
+The profiler is enabled by profiler.enable(), the profiling() context,
+or the environment variable AERONET_PROFILE=1 (AERONET_PROFILE=memory
+adds the heap peaks), e.g. for the nightly jobs.
+
+class stage_profiler (module instance: profiler)
+methods:
+  - enable (memory)      : memory=True traces the heap peaks (slower)
+  - disable()
+  - reset  ()            : drop the records
+  - records              : list of dict, one per call, nested stages have depth > 0
+    - stage, start_s, time_s, rows_in, rows_out, result_MB, peak_MB, depth
+  - summary()            : return df by stage of calls, total/mean/max time, rows, MB
+  - to_json(filename)    : trace of the calls (Chrome trace event format, chrome://tracing
+                           or ui.perfetto.dev) with the records and summary
+
+functions:
+  - profiled(method)     : decorator of the methods to record
+  - profiling(memory)    : context manager, enabled within the block
+
+'''''
+import os
+import json
+import time
+import functools
+import tracemalloc
+import contextlib
+import pandas as pd
+
+def frame_rows(value):
+  # Rows of a DataFrame, or number of site names
+  if isinstance(value,(pd.DataFrame,pd.Series,list)):
+    return len(value)
+  return None
+
+def frame_mb(value):
+  if isinstance(value,pd.DataFrame):
+    return value.memory_usage(index=False).sum()/1e6
+  if isinstance(value,pd.Series):
+    return value.memory_usage(index=False)/1e6
+  return None
+
+def input_rows(obj,args):
+  for arg in args:
+    if isinstance(arg,pd.DataFrame):
+      return len(arg)
+  # aeronet._df, not the df property, so a stage never loads data for the record
+  owner = obj if hasattr(obj,'_df') else getattr(obj,'aeronet',None)
+  df = getattr(owner,'_df',None)
+  return len(df) if df is not None else None
+
+class stage_profiler():
+
+  def __init__(self):
+    self.enabled = False
+    self.memory = self.started = False
+    self.records = []
+    self.stack = []
+    self.t0 = time.perf_counter()
+
+  def enable(self,memory=False):
+    self.memory = memory
+    # tracemalloc is stopped by disable() only if started here
+    self.started = memory and not tracemalloc.is_tracing()
+    if self.started:
+      tracemalloc.start()
+    self.enabled = True
+
+  def disable(self):
+    self.enabled = False
+    if self.started:
+      tracemalloc.stop()
+    self.memory = self.started = False
+
+  def reset(self):
+    self.records = []
+    self.stack = []
+    self.t0 = time.perf_counter()
+
+  def run(self,stage,obj,method,args,kwargs):
+    record = {'stage':stage, 'start_s':time.perf_counter()-self.t0, 'depth':len(self.stack),
+              'rows_in':input_rows(obj,args)}
+    if self.memory:
+      # The peak of the enclosing stage so far is kept before the counter is reset
+      current, peak = tracemalloc.get_traced_memory()
+      if self.stack:
+        self.stack[-1]['peak'] = max(self.stack[-1]['peak'],peak)
+      tracemalloc.reset_peak()
+      record.update(base=current,peak=current)
+    self.stack.append(record)
+
+    t0 = time.perf_counter()
+    try:
+      result = method(obj,*args,**kwargs)
+    finally:
+      record['time_s'] = time.perf_counter()-t0
+      self.stack.pop()
+      if self.memory:
+        peak = max(record.pop('peak'),tracemalloc.get_traced_memory()[1])
+        record['peak_MB'] = (peak-record.pop('base'))/1e6
+        if self.stack:
+          self.stack[-1]['peak'] = max(self.stack[-1]['peak'],peak)
+        tracemalloc.reset_peak()
+      self.records.append(record)
+
+    record['rows_out'] = frame_rows(result)
+    record['result_MB'] = frame_mb(result)
+    return result
+
+  def summary(self):
+    if not self.records:
+      return pd.DataFrame()
+    df = pd.DataFrame(self.records)
+    agg = {'calls':('time_s','size'), 'time_s':('time_s','sum'),
+           'mean_s':('time_s','mean'), 'max_s':('time_s','max'),
+           'rows_in':('rows_in','max'), 'rows_out':('rows_out','max'),
+           'result_MB':('result_MB','max')}
+    if 'peak_MB' in df.columns:
+      agg['peak_MB'] = ('peak_MB','max')
+    return df.groupby('stage',sort=False).agg(**agg).sort_values('time_s',ascending=False)
+
+  def to_json(self,filename):
+    events = [{'name':r['stage'], 'ph':'X', 'pid':os.getpid(), 'tid':0,
+               'ts':r['start_s']*1e6, 'dur':r['time_s']*1e6,
+               'args':{k:v for k,v in r.items() if k not in ['stage','start_s','time_s']}}
+              for r in self.records]
+    summary = self.summary()
+    trace = {'traceEvents':events,
+             'summary':json.loads(summary.to_json(orient='index')) if len(summary) else {}}
+    with open(filename,'w') as f:
+      json.dump(trace,f,indent=1,default=float)
+    print('Profile saved as {}'.format(filename))
+
+profiler = stage_profiler()
+if os.environ.get('AERONET_PROFILE','0') not in ['','0']:
+  profiler.enable(memory=os.environ['AERONET_PROFILE'] == 'memory')
+
+def profiled(method):
+  stage = method.__qualname__
+
+  @functools.wraps(method)
+  def wrapper(self,*args,**kwargs):
+    if not profiler.enabled:
+      return method(self,*args,**kwargs)
+    return profiler.run(stage,self,method,args,kwargs)
+
+  return wrapper
+
+@contextlib.contextmanager
+def profiling(memory=False):
+  profiler.enable(memory)
+  try:
+    yield profiler
+  finally:
+    profiler.disable()
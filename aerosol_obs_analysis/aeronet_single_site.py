@@ -1,22 +1,29 @@
-import datetime
+from .aeronet_profile import profiled
 
 class aeronet_single_site():
 
+  @profiled
   def __init__(self,aeronet,site):
 
-    df = aeronet.df[aeronet.df['AERONET_Site_Name']==site]
+    # Monthly values come from the cube of aeronet.df, see aeronet_climatology
+    self.aeronet = aeronet
+    self.cube = aeronet.monthly_cube()
 
     self.name = site
-    self.lon = df['Site_Longitude(Degrees)'].unique()[0]
-    self.lat = df['Site_Latitude(Degrees)'].unique()[0]
-
-    self.data= df
+    self.lat, self.lon = self.cube.coords(site)
     return
 
-  def monthly_average(self,vname):
-    data = self.data[['Date(dd:mm:yyyy)',vname]].dropna()
+  @property
+  def data(self):
+    # Daily records of the site, only read when used
+    return self.aeronet.site_data(self.name)
 
-    data['date_month'] = data['Date(dd:mm:yyyy)'].apply(lambda x: datetime.datetime(x.year,x.month,1))
-    ave = data.groupby(by='date_month').mean()
+  @profiled
+  def monthly_average(self,vname):
+    return self.aeronet.cached('monthly_average',(self.name,vname),
+                               lambda: self.cube.monthly(self.name,vname))
 
-    return ave
+  @profiled
+  def climatology(self,vname,by='month'):
+    # by='month' (Jan..Dec) or 'season' (DJF, MAM, JJA, SON)
+    return self.cube.climatology(self.name,vname,by)
@@ -0,0 +1,168 @@
+'''''
+
+Size distribution of AERONET inversion products
+
+The 22 bins of dV/dlnr are kept as the float columns 'Bin 1'..'Bin 22'.
+The dvdlnr accessor gives them as one contiguous (rows x 22) array for
+the averaging and plotting code:
+
+  df.dvdlnr.values            : read-only 2-D array of dV/dlnr, a view of the Bin columns
+  df.dvdlnr.to_numpy(copy)    : same, copy=True a writable copy
+  df.dvdlnr.has_data()        : rows with any bin value
+  df.dvdlnr.complete()        : rows with all 22 bins
+  df.dvdlnr.count(by,mask)    : number of rows with data, by group
+  df.dvdlnr.mean (by,mask)    : mean of each bin, by group
+    - by  : Series of group keys (e.g. df['AERONET_Site_Name'])
+    - mask: boolean array of the rows to include
+
+  df.dvdlnr.convert(to)       : 2-D array of dN/dlnr ('dN') or dS/dlnr ('dS')
+  df.dvdlnr.moments(fine_radius) : df of the moments of each row (index of df)
+
+The array is a view of the pandas block holding the Bin columns (no
+copy, read-only) when they are evenly spaced rows of one block, as in
+the frames of skim_inv; otherwise (e.g. columns set one by one) the
+columns are gathered into a new read-only array on each access. Either
+way it follows changes of the columns and nothing stays attached to the
+DataFrame.
+
+Conversions and moments work on any (rows x 22) array, one broadcast
+over the bins for all rows (e.g. the all-sites INV table):
+
+  convert(values,src,dst)     : 'dV', 'dN', 'dS' per dlnr, in the same bins
+  moments(values,src,fine_radius) : return dict of arrays (rows,)
+    - Volume, Surface, Number : integrals over ln(r) (trapezoidal)
+    - Reff                    : effective radius 3*Volume/Surface
+    - VMR                     : volume median radius
+    - Fine_Volume_Fraction, Coarse_Volume_Fraction: volume below/above fine_radius
+
+Rows with a missing bin give NaN moments.
+
+'''''
+import numpy as np
+import pandas as pd
+from .aeronet_aggregate import grouping
+
+size_bins = [0.05,0.065604, 0.086077, 0.112939, 0.148184,
+             0.194429, 0.255105, 0.334716, 0.439173, 0.576227,
+             0.756052, 0.991996, 1.301571, 1.707757, 2.240702,
+             2.939966, 3.857452, 5.06126, 6.640745, 8.713145,
+             11.432287, 15.0]
+
+bin_names = ['Bin {}'.format(i+1) for i in range(len(size_bins))]
+
+radius = np.array(size_bins)
+ln_radius = np.log(radius)
+fine_radius_default = 0.6 # [um], between the fine and coarse modes
+
+# dX/dlnr = dV/dlnr * per_volume[X]: number = volume/(4/3 pi r^3), surface = 3 volume/r
+per_volume = {'dV': np.ones(len(radius)),
+              'dN': 1/(4/3*np.pi*radius**3),
+              'dS': 3/radius}
+
+moment_names = ['Volume','Surface','Number','Reff','VMR',
+                'Fine_Volume_Fraction','Coarse_Volume_Fraction']
+
+# Trapezoidal weights over ln(r): integral = values @ weights
+d_ln_radius = np.diff(ln_radius)
+weights = np.r_[d_ln_radius,0]/2 + np.r_[0,d_ln_radius]/2
+
+def convert(values, src='dV', dst='dN'):
+  return np.asarray(values)*(per_volume[dst]/per_volume[src])
+
+def cumulative_volume(dv):
+  # Volume below each bin radius, (rows x 22)
+  steps = (dv[:,1:]+dv[:,:-1])/2*d_ln_radius
+  return np.concatenate([np.zeros((len(dv),1)),np.cumsum(steps,axis=1)],axis=1)
+
+def volume_below(dv, cum, r):
+  # Exact for dV/dlnr linear in ln(r) within the bin containing r
+  j = int(np.clip(np.searchsorted(ln_radius,np.log(r)),1,len(radius)-1))
+  t = np.clip((np.log(r)-ln_radius[j-1])/d_ln_radius[j-1],0,1)
+  return cum[:,j-1] + d_ln_radius[j-1]*(t*dv[:,j-1] + t**2/2*(dv[:,j]-dv[:,j-1]))
+
+def median_radius(dv, cum):
+  half = cum[:,-1]/2
+  # Bin with half of the volume below, solved for dV/dlnr linear in ln(r) within the bin
+  j = np.clip((cum < half[:,None]).sum(axis=1),1,len(radius)-1)
+  rows = np.arange(len(cum))
+  y0, y1, dx = dv[rows,j-1], dv[rows,j], d_ln_radius[j-1]
+  a, b, h = dx*(y1-y0)/2, dx*y0, half-cum[rows,j-1]
+  t = np.clip(2*h/(b+np.sqrt(np.maximum(b**2+4*a*h,0))),0,1)
+  vmr = np.exp(ln_radius[j-1] + t*dx)
+  return np.where(half > 0, vmr, np.nan)
+
+def moments(values, src='dV', fine_radius=fine_radius_default):
+  dv = convert(np.atleast_2d(np.asarray(values,dtype=np.float64)),src,'dV')
+  cum = cumulative_volume(dv)
+  volume  = cum[:,-1]
+  surface = dv @ (weights*per_volume['dS'])
+  number  = dv @ (weights*per_volume['dN'])
+
+  with np.errstate(invalid='ignore',divide='ignore'):
+    fine = volume_below(dv,cum,fine_radius)/volume
+    result = {'Volume' : volume,
+              'Surface': surface,
+              'Number' : number,
+              'Reff'   : 3*volume/surface,
+              'VMR'    : median_radius(dv,cum),
+              'Fine_Volume_Fraction'  : fine,
+              'Coarse_Volume_Fraction': 1-fine}
+  return result
+
+def bin_view(df):
+  # (rows x 22) view of the Bin columns if they are evenly spaced in one pandas block, else None
+  columns = [df[c].to_numpy() for c in bin_names]
+  first = columns[0]
+  if first.dtype.kind != 'f' or len(first) < 2:
+    return None
+  if any([c.dtype != first.dtype or c.strides != first.strides or c.base is None or c.base is not first.base
+          for c in columns]):
+    return None
+  address = [c.__array_interface__['data'][0] for c in columns]
+  step = address[1]-address[0]
+  if step == 0 or any([b-a != step for a, b in zip(address,address[1:])]):
+    return None
+  return np.lib.stride_tricks.as_strided(first,shape=(len(first),len(columns)),
+                                         strides=(first.strides[0],step),writeable=False)
+
+@pd.api.extensions.register_dataframe_accessor('dvdlnr')
+class dvdlnr_accessor():
+
+  def __init__(self, df):
+    self._df = df
+
+  @property
+  def values(self):
+    return self.to_numpy()
+
+  def to_numpy(self, copy=False):
+    view = None if copy else bin_view(self._df)
+    if view is not None:
+      return view
+    values = np.ascontiguousarray(self._df[bin_names].to_numpy(copy=copy))
+    values.flags.writeable = copy
+    return values
+
+  def has_data(self):
+    return ~np.isnan(self.values).all(axis=1)
+
+  def complete(self):
+    return ~np.isnan(self.values).any(axis=1)
+
+  def count(self, by, mask=None):
+    has_data = self.has_data()
+    if mask is not None:
+      has_data &= np.asarray(mask)
+    g = grouping(by)
+    counts = g.reduce(has_data.astype(float),['sum'])['sum'][:,0]
+    return pd.Series(counts.astype(int), index=g.labels, name='dV/dlnr')
+
+  def mean(self, by, mask=None):
+    g = grouping(by, mask)
+    return pd.DataFrame(g.reduce(self.values,['mean'])['mean'], index=g.labels, columns=bin_names)
+
+  def convert(self, to='dN'):
+    return convert(self.values,'dV',to)
+
+  def moments(self, fine_radius=fine_radius_default):
+    return pd.DataFrame(moments(self.values,fine_radius=fine_radius),index=self._df.index)
@@ -0,0 +1,129 @@
+'''''
+
+Spatial index over the AERONET site coordinates
+
+A site's coordinates are constant, so the index holds one point per site
+(first record of the site in df) instead of one per daily record.
+
+class site_locator
+methods:
+  - __init__(df)
+  - bbox     (lat,lon)           : return list_of_site_names
+    - Open interval as aeronet.select_sites. lon[0] > lon[1] (after
+      wrapping to [-180,180)) selects across the dateline, e.g. [170,-170]
+  - radius   (lat,lon,radius_km) : return list_of_site_names, nearest first
+  - nearest  (lat,lon,k)         : return list_of_site_names, nearest first
+  - nearest_many(lats,lons,k)    : return (site_positions, distances_km), shape (n,k)
+    - Vectorized over many points, e.g. model grid cells
+  - coords   ()                  : return df of site lat/lon
+
+bbox and radius search a latitude band found by bisection on the
+latitude-sorted sites.
+
+nearest_many queries a KD-tree of the site unit vectors (scipy.spatial.cKDTree,
+built on first use) when scipy is installed, O(points x log(sites)).
+Without scipy it compares every point with every site in chunks of points,
+O(points x sites): fine for the ~1,000 AERONET sites, slow for many more.
+
+'''''
+import numpy as np
+import pandas as pd
+
+site_col = 'AERONET_Site_Name'
+lat_col  = 'Site_Latitude(Degrees)'
+lon_col  = 'Site_Longitude(Degrees)'
+
+earth_radius = 6371.0 # km
+km_per_deg   = np.pi*earth_radius/180
+
+def wrap_lon(lon):
+  return (np.asarray(lon,dtype=float)+180)%360-180
+
+def unit_vectors(lat,lon):
+  lat, lon = np.radians(lat), np.radians(lon)
+  return np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)],axis=-1)
+
+def chord_to_km(dot):
+  return earth_radius*np.arccos(np.clip(dot,-1,1))
+
+def straight_to_km(chord):
+  # Straight-line distance between unit vectors to great-circle distance
+  return 2*earth_radius*np.arcsin(np.clip(chord/2,0,1))
+
+class site_locator():
+
+  def __init__(self,df):
+    sites = df.drop_duplicates(subset=site_col)
+
+    # Site positions follow the first appearance in df
+    self.names = np.asarray(sites[site_col]).astype(object)
+    self.lats  = sites[lat_col].values.astype(float)
+    self.lons  = wrap_lon(sites[lon_col].values)
+    self.xyz   = unit_vectors(self.lats,self.lons)
+
+    self.lat_order  = np.argsort(self.lats, kind='stable')
+    self.lat_sorted = self.lats[self.lat_order]
+    self.tree = None
+
+  def coords(self):
+    return pd.DataFrame({lat_col:self.lats, lon_col:self.lons},
+                        index=pd.Index(self.names,name=site_col))
+
+  def lat_band(self,lat_min,lat_max,closed=False):
+    start = np.searchsorted(self.lat_sorted, lat_min, side='left' if closed else 'right')
+    stop  = np.searchsorted(self.lat_sorted, lat_max, side='right' if closed else 'left')
+    return self.lat_order[start:max(start,stop)]
+
+  def bbox(self,lat=[0,30],lon=[0,10]):
+    pos = self.lat_band(lat[0],lat[1])
+    lons = self.lons[pos]
+
+    if lon[1]-lon[0] < 360:
+      lon_min, lon_max = wrap_lon(lon[0]), wrap_lon(lon[1])
+      if lon_min <= lon_max:
+        pos = pos[(lons > lon_min) & (lons < lon_max)]
+      else: # Across the dateline
+        pos = pos[(lons > lon_min) | (lons < lon_max)]
+
+    return list(self.names[np.sort(pos)])
+
+  def radius(self,lat,lon,radius_km):
+    dlat = radius_km/km_per_deg
+    pos = self.lat_band(lat-dlat,lat+dlat,closed=True)
+    dist = chord_to_km(self.xyz[pos] @ unit_vectors(lat,wrap_lon(lon)))
+    order = np.argsort(dist, kind='stable')
+    order = order[dist[order] <= radius_km]
+
+    return list(self.names[pos[order]])
+
+  def nearest(self,lat,lon,k=1):
+    pos, dist = self.nearest_many([lat],[lon],k)
+    return list(self.names[pos[0]])
+
+  def nearest_many(self,lats,lons,k=1,chunk=4096):
+    points = unit_vectors(np.asarray(lats,dtype=float),wrap_lon(lons))
+    k = min(k,len(self.names))
+    try:
+      from scipy.spatial import cKDTree
+    except ImportError:
+      return self.nearest_brute(points,k,chunk)
+
+    if self.tree is None:
+      self.tree = cKDTree(self.xyz)
+    chord, pos = self.tree.query(points,k=k)
+    return pos.reshape(len(points),k), straight_to_km(chord.reshape(len(points),k))
+
+  def nearest_brute(self,points,k,chunk):
+    pos  = np.empty((len(points),k),dtype=int)
+    dist = np.empty((len(points),k))
+
+    for i in range(0,len(points),chunk):
+      dot = points[i:i+chunk] @ self.xyz.T
+      # Largest dot product = smallest great-circle distance
+      top = np.argpartition(-dot,k-1,axis=1)[:,:k]
+      top_dot = np.take_along_axis(dot,top,axis=1)
+      order = np.argsort(-top_dot,axis=1,kind='stable')
+      pos[i:i+chunk]  = np.take_along_axis(top,order,axis=1)
+      dist[i:i+chunk] = chord_to_km(np.take_along_axis(top_dot,order,axis=1))
+
+    return pos, dist
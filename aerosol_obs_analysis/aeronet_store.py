@@ -0,0 +1,111 @@
+'''''
+
+Columnar on-disk store for AERONET DataFrames
+
+Parquet files are written sorted by date in row groups, so that reading
+a time range only decompresses the row groups overlapping it (predicate
+pushdown on the row group statistics). Feather files support column
+projection only; the time and site filters are applied after reading.
+Pickles are still read, which keeps the old COM20_*.pkl files usable.
+.mmap stores (aeronet_mmap) are directories of memory-mapped arrays
+sorted by (site, date), shared by the processes reading them.
+
+Functions:
+  - save_df       (df,filename)                      : save df, format from extension
+  - read_df       (filename,columns,time_range,sites) : return df
+    - columns   : list of columns to read (None for all)
+    - time_range: [start, end], same open interval as aeronet.filter_time
+    - sites     : list of AERONET_Site_Name
+  - read_columns  (columns,time_range,sites)         : return columns read by read_df
+  - migrate_pickle(pickle_name,fmt)                   : return store_name
+  - store_name    (pickle_name,fmt)                   : return store_name
+
+Requires pyarrow for .parquet and .feather files.
+df read from a .mmap store is a read-only view of the mapped arrays.
+
+'''''
+import os
+import pandas as pd
+from .aeronet_mmap import write_mmap, mmap_store
+
+date_col = 'Date(dd:mm:yyyy)'
+site_col = 'AERONET_Site_Name'
+
+store_formats = {'parquet':'.parquet', 'feather':'.feather', 'mmap':'.mmap', 'pickle':'.pkl'}
+row_group_size = 100000
+
+def store_format(filename):
+  ext = os.path.splitext(filename)[1]
+  for fmt, fmt_ext in store_formats.items():
+    if ext == fmt_ext:
+      return fmt
+  return 'pickle'
+
+def store_name(pickle_name, fmt='parquet'):
+  return os.path.splitext(pickle_name)[0]+store_formats[fmt]
+
+def save_df(df, filename):
+  fmt = store_format(filename)
+  if fmt == 'pickle':
+    df.to_pickle(filename)
+    return
+  if fmt == 'mmap':
+    write_mmap(df, filename)
+    return
+
+  # Old list column, same as the Bin columns (df.dvdlnr.values)
+  df = df.drop(columns=['dV/dlnr'], errors='ignore')
+  if date_col in df.columns:
+    df = df.sort_values(by=[date_col,site_col] if site_col in df.columns else [date_col],
+                        kind='mergesort')
+  df = df.reset_index(drop=True)
+
+  if fmt == 'parquet':
+    df.to_parquet(filename, engine='pyarrow', index=False, row_group_size=row_group_size)
+  else:
+    df.to_feather(filename)
+
+def read_columns(columns, time_range=None, sites=None):
+  if columns is None:
+    return None
+  # Filtered columns are always read
+  columns = [c for c in columns if c != 'dV/dlnr']
+  return columns + [c for c in [date_col]*bool(time_range) + [site_col]*bool(sites)
+                    if c not in columns]
+
+def read_df(filename, columns=None, time_range=None, sites=None):
+  fmt = store_format(filename)
+
+  columns = read_columns(columns, time_range, sites)
+
+  if fmt == 'mmap':
+    return mmap_store(filename).frame(columns, sites, time_range)
+  if fmt == 'parquet':
+    import pyarrow.parquet as pq
+    filters = []
+    if time_range:
+      filters += [(date_col,'>',pd.Timestamp(time_range[0])),
+                  (date_col,'<',pd.Timestamp(time_range[1]))]
+    if sites:
+      filters += [(site_col,'in',list(sites))]
+    df = pq.read_table(filename, columns=columns, filters=filters or None).to_pandas()
+  else:
+    if fmt == 'feather':
+      df = pd.read_feather(filename, columns=columns)
+    else:
+      df = pd.read_pickle(filename)
+      if columns is not None:
+        df = df[columns]
+    if time_range:
+      df = df[(df[date_col] > pd.Timestamp(time_range[0])) &
+              (df[date_col] < pd.Timestamp(time_range[1]))]
+    if sites:
+      df = df[df[site_col].isin(sites)]
+
+  return df.drop(columns=['dV/dlnr'], errors='ignore')
+
+def migrate_pickle(pickle_name, fmt='parquet'):
+  filename = store_name(pickle_name, fmt)
+  print('Converting {} to {}'.format(pickle_name,filename))
+  save_df(pd.read_pickle(pickle_name), filename)
+  return filename
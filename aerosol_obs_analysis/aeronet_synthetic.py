@@ -0,0 +1,188 @@
+'''''
+
+Synthetic AERONET Level 2.0 daily files
+
+Writes site files in the layout read by aeronet.extract_daily_from_raw
+and aeronet.read_daily_files: 6 header lines, comma-delimited, -999 for
+missing values, AOD files in AOD/AOD20/DAILY/ and inversion files (22
+size bins) in INV/LEV20/ALL/DAILY/ under root.
+
+The values are random but consistent: a seasonal lognormal AOD at 500nm,
+the other wavelengths from the Angstrom exponent, a bimodal lognormal
+volume distribution whose fine/coarse volumes follow the fine/coarse
+AOD, and REff/VolC/VMR from its moments (aeronet_size_analysis). A few
+sites report the 443/667/865nm inversion channels instead of
+440/675/870nm, as the instruments that skim_inv coalesces. The inversion
+files carry the text columns of the real ones (quality level, scan type,
+processing date and time).
+
+functions:
+  - write_synthetic(root,n_sites,n_years,start_year,inv_fraction,missing,seed) : return dict of paths
+    - n_sites x n_years of days, each site observing a random share of the days
+    - inv_fraction: share of the AOD days with an inversion record
+    - missing: share of the measurement values written as -999
+  - site_table(...)  : return df_aod, df_inv of one site (as written)
+
+Usage:
+  python -m aerosol_obs_analysis.aeronet_synthetic root n_sites n_years
+
+'''''
+import os
+import sys
+import datetime
+import numpy as np
+import pandas as pd
+from .aeronet_size_analysis import size_bins, moments
+
+aod_data_path = 'AOD/AOD20/DAILY/'
+inv_data_path = 'INV/LEV20/ALL/DAILY/'
+file_period = '19930101_20231231'
+missing_value = -999.
+
+aod_wavelengths = [1640,1020,870,675,500,440,380,340]
+angstrom_pairs = ['440-870','380-500','440-675','500-870','340-440']
+
+inv_wavelengths = {'standard':['440nm','675nm','870nm','1020nm'],
+                   'alternate':['443nm','667nm','865nm','1020nm']}
+inv_keys = ['AOD_Extinction-Total','AOD_Extinction-Fine','AOD_Extinction-Coarse',
+            'Single_Scattering_Albedo','Absorption_AOD',
+            'Asymmetry_Factor-Total','Asymmetry_Factor-Fine','Asymmetry_Factor-Coarse']
+
+# Bimodal volume distribution: radius [um], ln(sigma); volume per unit fine/coarse AOD at 440nm
+fine_mode, coarse_mode = (0.15,0.45), (2.5,0.65)
+volume_per_aod = {'fine':0.25, 'coarse':0.9}
+
+def header(site,product):
+  return ['AERONET Version 3; {}'.format(product),
+          site,
+          'Version 3: AOD Level 2.0 (synthetic)',
+          'The following data are automatically cloud cleared and quality assured with pre-field and post-field calibration applied.',
+          'Contact: PI=synthetic; PI Email=none',
+          'Daily Averages,UNITS can be found at,,, https://aeronet.gsfc.nasa.gov/new_web/units.html']
+
+def lognormal_mode(r0,ln_sigma):
+  r = np.array(size_bins)
+  return np.exp(-np.log(r/r0)**2/(2*ln_sigma**2))/(np.sqrt(2*np.pi)*ln_sigma)
+
+def site_table(rng,name,lat,lon,elevation,days,inv_fraction=0.3,missing=0.02,
+               channels='standard'):
+  n = len(days)
+  doy = days.dayofyear.to_numpy()
+
+  # AOD at 500nm: seasonal site median, daily lognormal spread; Angstrom exponent around a site mean
+  median = np.exp(rng.normal(np.log(0.15),0.6))
+  phase = rng.uniform(0,365)
+  aod500 = median*(1+0.4*np.sin(2*np.pi*(doy-phase)/365))*np.exp(rng.normal(0,0.4,n))
+  alpha = np.clip(rng.uniform(0.2,1.8)+rng.normal(0,0.15,n),0,2.5)
+
+  aod = {'AERONET_Site'            : name,
+         'Date(dd:mm:yyyy)'        : days.strftime('%d:%m:%Y'),
+         'Time(hh:mm:ss)'          : '12:00:00',
+         'Day_of_Year'             : doy,
+         'Day_of_Year(Fraction)'   : doy+0.5}
+  for wl in aod_wavelengths:
+    aod['AOD_{}nm'.format(wl)] = aod500*(wl/500)**-alpha
+  aod['Precipitable_Water(cm)'] = rng.gamma(2,1,n)
+  for pair in angstrom_pairs:
+    aod['{}_Angstrom_Exponent'.format(pair)] = alpha+rng.normal(0,0.05,n)
+  for wl in aod_wavelengths:
+    aod['N[AOD_{}nm]'.format(wl)] = rng.integers(5,60,n)
+  aod.update({'Data_Quality_Level'       : 'lev20',
+              'AERONET_Instrument_Number': rng.integers(1,1000),
+              'AERONET_Site_Name'        : name,
+              'Site_Latitude(Degrees)'   : lat,
+              'Site_Longitude(Degrees)'  : lon,
+              'Site_Elevation(m)'        : elevation})
+  df_aod = pd.DataFrame(aod)
+  if channels == 'standard' and rng.random() < 0.5:
+    df_aod['AOD_1640nm'] = missing_value # No 1640nm channel
+
+  # Inversions on a share of the AOD days
+  rows = np.flatnonzero(rng.random(n) < inv_fraction)
+  m = len(rows)
+  a440 = aod500[rows]*(440/500)**-alpha[rows]
+  fine = np.clip(alpha[rows]/2.2,0.05,0.98)
+  dv = (volume_per_aod['fine']*fine*a440)[:,None]*lognormal_mode(*fine_mode)[None,:] \
+     + (volume_per_aod['coarse']*(1-fine)*a440)[:,None]*lognormal_mode(*coarse_mode)[None,:]
+  dv *= np.exp(rng.normal(0,0.05,dv.shape))
+  mom = moments(dv)
+
+  inv = {'AERONET_Site'         : name,
+         'Date(dd:mm:yyyy)'     : days[rows].strftime('%d:%m:%Y'),
+         'Time(hh:mm:ss)'       : '12:00:00',
+         'Day_of_Year'          : doy[rows],
+         'Day_of_Year(Fraction)': doy[rows]+0.5}
+  for wl_set, wls in inv_wavelengths.items():
+    for key in inv_keys:
+      for wl in wls:
+        if wl_set == 'alternate' and wl == '1020nm':
+          continue
+        column = '{}[{}]'.format(key,wl)
+        if wl_set != channels and wl != '1020nm':
+          inv[column] = missing_value
+          continue
+        wl_um = float(wl[:-2])/1000
+        total = aod500[rows]*(wl_um/0.5)**-alpha[rows]
+        ssa = np.clip(rng.normal(0.92,0.03,m)-0.03*(wl_um-0.44),0.7,1)
+        inv[column] = {'AOD_Extinction-Total'   : total,
+                       'AOD_Extinction-Fine'    : total*fine,
+                       'AOD_Extinction-Coarse'  : total*(1-fine),
+                       'Single_Scattering_Albedo': ssa,
+                       'Absorption_AOD'         : total*(1-ssa),
+                       'Asymmetry_Factor-Total' : rng.normal(0.68,0.03,m),
+                       'Asymmetry_Factor-Fine'  : rng.normal(0.62,0.03,m),
+                       'Asymmetry_Factor-Coarse': rng.normal(0.75,0.03,m)}[key]
+  for suffix, ratio in [('T',1),('F',fine),('C',1-fine)]:
+    inv['VolC-'+suffix] = mom['Volume']*ratio
+  inv['REff-T'] = mom['Reff']
+  inv['REff-F'] = fine_mode[0]*np.exp(2.5*fine_mode[1]**2)*np.ones(m)
+  inv['REff-C'] = coarse_mode[0]*np.exp(2.5*coarse_mode[1]**2)*np.ones(m)
+  inv['VMR-T'] = mom['VMR']
+  for i, r in enumerate(size_bins):
+    inv['{:.6f}'.format(r)] = dv[:,i]
+  inv.update({'Latitude(Degrees)' : lat,
+              'Longitude(Degrees)': lon,
+              'Elevation(m)'      : elevation,
+              # Text columns of the inversion files outside the ingest schema's known list
+              'Inversion_Data_Quality_Level'     : 'lev20',
+              'Retrieval_Measurement_Scan-Type'  : 'Almucantar',
+              'Last_Processing_Date(dd:mm:yyyy)' : '01:01:2024',
+              'Last_Processing_Time(hh:mm:ss)'   : '12:00:00'})
+  df_inv = pd.DataFrame(inv)
+
+  # Missing measurements
+  for df in [df_aod,df_inv]:
+    values = [c for c in df.columns if df[c].dtype.kind == 'f' and
+              not any([k in c for k in ['Degrees','Elevation','Day_of_Year']])]
+    block = df[values].to_numpy()
+    block[rng.random(block.shape) < missing] = missing_value
+    df[values] = block
+  return df_aod, df_inv
+
+def write_site(filename,lines,df):
+  with open(filename,'w') as f:
+    f.write('\n'.join(lines)+'\n')
+    df.to_csv(f,index=False,float_format='%.6f',lineterminator='\n')
+
+def write_synthetic(root,n_sites=20,n_years=2,start_year=2005,inv_fraction=0.3,missing=0.02,seed=0):
+  rng = np.random.default_rng(seed)
+  paths = {'AOD':os.path.join(root,aod_data_path), 'INV':os.path.join(root,inv_data_path)}
+  for path in paths.values():
+    os.makedirs(path,exist_ok=True)
+
+  calendar = pd.date_range(datetime.date(start_year,1,1),datetime.date(start_year+n_years-1,12,31),freq='D')
+  for i in range(n_sites):
+    name = 'Synthetic_{:04d}'.format(i)
+    lat, lon = np.degrees(np.arcsin(rng.uniform(-0.95,0.95))), rng.uniform(-180,180)
+    days = calendar[rng.random(len(calendar)) < rng.uniform(0.3,0.8)]
+    channels = 'alternate' if rng.random() < 0.1 else 'standard'
+    df_aod, df_inv = site_table(rng,name,lat,lon,rng.uniform(0,3000),days,
+                                inv_fraction,missing,channels)
+    write_site(paths['AOD']+'{}_{}.lev20'.format(file_period,name),header(name,'AOD'),df_aod)
+    write_site(paths['INV']+'{}_{}.all'.format(file_period,name),header(name,'INV'),df_inv)
+
+  print('Synthetic data of {} sites, {} years written in {}'.format(n_sites,n_years,root))
+  return paths
+
+if __name__ == '__main__':
+  write_synthetic(sys.argv[1],int(sys.argv[2]),int(sys.argv[3]))
@@ -0,0 +1,112 @@
+'''''
+
+Daily series of AERONET data on a fixed calendar
+
+The records of all sites are scattered once into (site x day) arrays,
+one per column, with NaN on the days without a record. The rolling
+statistics and anomalies are computed along the day axis for all sites
+at once (pandas rolling over the columns of a day x site frame), not
+site by site.
+
+class daily_series
+methods:
+  - __init__(df,columns,sites,time_range)
+    - sites: default all sites of df, time_range: default first to last date of df
+    - Days with several records of a site take their mean
+  - values [var]             : (site x day) float32 array, NaN on missing days
+  - valid  (var)             : (site x day) bool array of the days with a value
+  - gaps   (var,min_days)    : (site x day) bool array of the missing days in runs of min_days or more,
+                               between the first and last valid day of each site
+  - rolling(var,window,stat,min_periods,center) : (site x day) array
+    - stat: 'mean', 'median', 'std', 'min', 'max', 'count'
+  - anomaly(var,reference)   : (site x day) array of value - reference
+    - reference: 'month' (mean of the site in that calendar month, all years)
+                 or an int window (centered rolling mean)
+  - site   (site,var,window,stat) : return df of one site, index dates, columns var, valid
+                                    (and var_rolling if window)
+  - nbytes                   : size of the arrays
+
+'''''
+import numpy as np
+import pandas as pd
+
+site_col = 'AERONET_Site_Name'
+date_col = 'Date(dd:mm:yyyy)'
+
+class daily_series():
+
+  def __init__(self,df,columns=['AOD_500nm'],sites=None,time_range=None):
+    days = df[date_col].values.astype('datetime64[D]')
+    if time_range:
+      day0, day1 = [np.datetime64(pd.Timestamp(t),'D') for t in time_range]
+    else:
+      day0, day1 = days[~np.isnat(days)].min(), days[~np.isnat(days)].max()
+    if sites is None:
+      sites = np.sort(np.asarray(df[site_col].unique()).astype(str))
+    self.sites = pd.Index(sites,name=site_col)
+    self.dates = pd.date_range(day0,day1,freq='D',name=date_col)
+    n_sites, n_days = len(self.sites), len(self.dates)
+
+    # Flat (site, day) position of each record, -1 outside sites or calendar
+    codes = pd.Categorical(df[site_col],categories=self.sites).codes.astype(np.int64)
+    offsets = (days-day0).astype(np.int64)
+    keep = (codes >= 0) & ~np.isnat(days) & (offsets >= 0) & (offsets < n_days)
+    cells = codes[keep]*n_days + offsets[keep]
+
+    self.values = {}
+    for c in columns:
+      v = df[c].to_numpy(dtype=np.float64)[keep]
+      finite = ~np.isnan(v)
+      total = np.bincount(cells[finite],weights=v[finite],minlength=n_sites*n_days)
+      count = np.bincount(cells[finite],minlength=n_sites*n_days)
+      with np.errstate(invalid='ignore',divide='ignore'):
+        self.values[c] = (total/count).astype(np.float32).reshape(n_sites,n_days)
+
+  @property
+  def nbytes(self):
+    return sum([v.nbytes for v in self.values.values()])
+
+  def valid(self,var):
+    return ~np.isnan(self.values[var])
+
+  def gaps(self,var,min_days=1):
+    valid = self.valid(var)
+    # Between the first and last valid day of each site
+    inside = (np.cumsum(valid,axis=1) > 0) & (np.cumsum(valid[:,::-1],axis=1)[:,::-1] > 0)
+    missing = inside & ~valid
+    if min_days <= 1:
+      return missing
+
+    # Length of each run of missing days, a False column keeps the runs within a site
+    m = np.hstack([missing,np.zeros((len(missing),1),dtype=bool)]).ravel()
+    run = np.cumsum(m & ~np.r_[False,m[:-1]])*m
+    length = np.bincount(run)
+    long_run = (length[run] >= min_days) & m
+    return long_run.reshape(len(missing),-1)[:,:-1]
+
+  def rolling(self,var,window=31,stat='mean',min_periods=1,center=True):
+    frame = pd.DataFrame(self.values[var].T)
+    rolled = getattr(frame.rolling(window,min_periods=min_periods,center=center),stat)()
+    return rolled.to_numpy(dtype=np.float32).T
+
+  def anomaly(self,var,reference='month'):
+    values = self.values[var]
+    if reference == 'month':
+      # Mean of each (site, calendar month) over all years
+      month = self.dates.month.to_numpy()-1
+      cells = (np.arange(len(self.sites))[:,None]*12 + month[None,:]).ravel()
+      v = values.ravel().astype(np.float64)
+      finite = ~np.isnan(v)
+      total = np.bincount(cells[finite],weights=v[finite],minlength=len(self.sites)*12)
+      count = np.bincount(cells[finite],minlength=len(self.sites)*12)
+      with np.errstate(invalid='ignore',divide='ignore'):
+        mean = (total/count).reshape(-1,12)
+      return (values - mean[:,month]).astype(np.float32)
+    return values - self.rolling(var,window=reference,stat='mean')
+
+  def site(self,site,var,window=None,stat='mean'):
+    i = self.sites.get_loc(site)
+    df = pd.DataFrame({var: self.values[var][i], 'valid': self.valid(var)[i]},index=self.dates)
+    if window:
+      df[var+'_rolling'] = getattr(df[var].rolling(window,min_periods=1,center=True),stat)()
+    return df
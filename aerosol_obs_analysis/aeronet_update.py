@@ -0,0 +1,61 @@
+'''''
+
+Incremental update of the all-sites store
+
+A manifest next to the store records, for every raw site file, the
+mtime and size at the last ingest and the last date ingested from it.
+AERONET appends new days to the site files, so a file that grew is read
+from its previous size onwards only. A file that shrank or was rewritten
+with the same size is read again in full and replaces its site's rows.
+
+Functions:
+  - manifest_name(store_name)             : return manifest file name
+  - load_manifest(filename)               : return manifest (empty if missing)
+  - save_manifest(manifest,filename)
+  - scan_files   (file_path)              : return {file: {'mtime','size'}}
+  - plan_update  (manifest,files)         : return {'new','appended','changed','removed'}
+
+Used by aeronet.update_daily and aeronet.update_average.
+
+'''''
+import os
+import json
+
+def manifest_name(store_name):
+  return os.path.splitext(store_name)[0]+'_manifest.json'
+
+def load_manifest(filename):
+  if not os.path.exists(filename):
+    return {'files':{}}
+  with open(filename) as f:
+    return json.load(f)
+
+def save_manifest(manifest,filename):
+  with open(filename,'w') as f:
+    json.dump(manifest,f,indent=1,sort_keys=True)
+
+def scan_files(file_path):
+  files = {}
+  for f in sorted(os.listdir(file_path)):
+    stat = os.stat(file_path+f)
+    files[f] = {'mtime':stat.st_mtime, 'size':stat.st_size}
+  return files
+
+def plan_update(manifest,files):
+  plan = {'new':[], 'appended':[], 'changed':[], 'removed':[]}
+  old_files = manifest['files']
+
+  for f, stat in files.items():
+    if f not in old_files:
+      plan['new'].append(f)
+      continue
+    old = old_files[f]
+    if stat['mtime'] == old['mtime'] and stat['size'] == old['size']:
+      continue
+    if stat['size'] > old['size']:
+      plan['appended'].append(f)
+    else:
+      plan['changed'].append(f)
+
+  plan['removed'] = [f for f in old_files if f not in files]
+  return plan
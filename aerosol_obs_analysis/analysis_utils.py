@@ -14,6 +14,155 @@ def extract_tar(tarname,path=None):
   print('Finish extracting tar file')
   return
 
+# Ingest schema: text columns as str, day counts as int32,
+# every other (measurement) column as float32.
+# The text columns are the known ones and those with text in the first data row
+# (quality levels, processing times, scan types of the inversion files)
+str_columns = ['AERONET_Site_Name','AERONET_Site','Date(dd:mm:yyyy)','Time(hh:mm:ss)',
+               'Data_Quality_Level','Last_Date_Processed','Last_Processing_Date(dd:mm:yyyy)']
+int_columns = ['Day_of_Year']
+# Missing values in the AERONET files, read as NaN
+missing_value = -999.
+site_columns = ['AERONET_Site_Name','AERONET_Site']
+
+def ingest_dtypes(columns, text_columns=()):
+  return {c: str if c in str_columns or c in text_columns else 'int32' if c in int_columns else 'float32'
+          for c in columns}
+
+def text_columns(first_row):
+  # Columns of the first data row that do not parse as numbers
+  return [c for c in first_row.columns if first_row[c].dtype == object]
+
+def read_daily_file(filename, offset=0):
+  # offset > 0: only the rows after that byte position of the file,
+  # i.e. the rows appended since a file of that size was read
+  import io
+  import pandas as pd
+  columns = pd.read_table(filename,header=6,delimiter=',',nrows=0).columns
+  if hasattr(filename,'seek'):
+    filename.seek(0)
+  if offset:
+    with open(filename,'rb') as f:
+      f.seek(offset)
+      filename = io.BytesIO(f.read())
+    if not filename.getvalue().strip():
+      return pd.DataFrame(columns=columns).astype(ingest_dtypes(columns))
+    header = dict(header=None,names=columns)
+  else:
+    header = dict(header=6)
+  first_row = pd.read_table(filename,delimiter=',',nrows=1,na_values=[missing_value],**header)
+  if hasattr(filename,'seek'):
+    filename.seek(0)
+  dtypes = ingest_dtypes(columns,text_columns(first_row))
+  try:
+    return pd.read_table(filename,delimiter=',',dtype=dtypes,na_values=[missing_value],**header)
+  except (ValueError, TypeError):
+    # Text further down a column read as float32: those columns as str, read again
+    if hasattr(filename,'seek'):
+      filename.seek(0)
+    df = pd.read_table(filename,delimiter=',',dtype=str,na_values=[missing_value],**header)
+    for c, dtype in dtypes.items():
+      if dtype == str:
+        continue
+      values = pd.to_numeric(df[c],errors='coerce')
+      if values.isna().sum() > df[c].isna().sum():
+        continue # Text column, kept as str
+      values = values.where(values != missing_value)
+      df[c] = values.astype('int32' if dtype == 'int32' and values.notna().all() else 'float32')
+    return df
+
+def apply_ingest_schema(df):
+  # After merging the sites: categorical site names and vectorized date parsing
+  import pandas as pd
+  for c in site_columns:
+    if c in df.columns:
+      df[c] = df[c].astype('category')
+  df['Date(dd:mm:yyyy)'] = pd.to_datetime(df['Date(dd:mm:yyyy)'],format='%d:%m:%Y')
+  return df
+
+def memory_footprint(df):
+  # Returns (bytes used, estimated bytes with float64/int64 columns and object site names),
+  # the estimate is computed from df, not measured on a second read
+  import numpy as np
+  mem = df.memory_usage(index=True, deep=True)
+  before = mem['Index']
+  for c in df.columns:
+    if df[c].dtype in ['float32','int32']:
+      before += mem[c]*2
+    elif df[c].dtype.name == 'category':
+      # 8 byte pointer per row + one str object (49 bytes + length) per row
+      lens = np.asarray(df[c].cat.categories.str.len())+49
+      before += 8*len(df) + lens[df[c].cat.codes.values].sum()
+    else:
+      before += mem[c]
+  return mem.sum(), before
+
+def read_daily_files(filenames, n_workers=1, progress=True):
+  # Returns one DataFrame per file, in the order of filenames
+  import os
+  from concurrent.futures import ProcessPoolExecutor
+
+  n_workers = n_workers or os.cpu_count()
+
+  def collect(results):
+    single_site = []
+    for df in results:
+      single_site.append(df)
+      if progress:
+        draw_progress_bar(len(single_site)/len(filenames))
+    return single_site
+
+  if n_workers == 1 or len(filenames) < 2:
+    return collect(map(read_daily_file, filenames))
+
+  chunksize = max(1, len(filenames)//(n_workers*4))
+  with ProcessPoolExecutor(max_workers=n_workers) as executor:
+    return collect(executor.map(read_daily_file, filenames, chunksize=chunksize))
+
+def read_daily_tar(tarname, member_path='', n_workers=1, in_flight=2):
+  # Returns one DataFrame per member under member_path, sorted by file name
+  # like read_daily_files on the extracted directory.
+  # The archive is read sequentially ('r|*'), so a .tar.gz is decompressed once;
+  # with a pool, at most in_flight members per worker are read ahead of the parsing
+  import io
+  import os
+  import tarfile
+  from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+  n_workers = n_workers or os.cpu_count()
+  executor = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+
+  single_site = {}
+  pending = set()
+  try:
+    with tarfile.open(tarname, 'r|*') as tar:
+      for member in tar:
+        name = member.name[2:] if member.name.startswith('./') else member.name
+        if not member.isfile() or not name.startswith(member_path):
+          continue
+        if executor and len(pending) >= n_workers*in_flight:
+          # The bytes of a member are held until it is parsed
+          done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        data = tar.extractfile(member).read()
+        if executor:
+          future = executor.submit(read_daily_file, io.BytesIO(data))
+          pending.add(future)
+          single_site[os.path.basename(name)] = future
+        else:
+          single_site[os.path.basename(name)] = read_daily_file(io.BytesIO(data))
+        data = None
+        print('\rRead {} files from {}'.format(len(single_site),tarname),end='')
+
+    names = sorted(single_site.keys())
+    if executor:
+      single_site = {name: single_site[name].result() for name in names}
+  finally:
+    if executor:
+      executor.shutdown()
+  print()
+
+  return [single_site[name] for name in names]
+
 def draw_progress_bar(percent, bar_len = 50):
   import sys
   sys.stdout.write("\r")
@@ -0,0 +1,112 @@
+'''''
+
+Batch rendering of single site figures
+
+Figures are drawn with the object-oriented Agg API (Figure and
+FigureCanvasAgg), without pyplot's global state, on one figure per
+process that is cleared once saved (new_figure). The sites are spread over a process pool; a job
+only carries the values to plot (monthly averages, size distribution),
+not aeronet.df.
+
+functions:
+  - render_jobs(jobs,n_workers) : return list of {'file','site','figure','time_s'}, in the order of jobs
+    - jobs: list of (figure, kwargs), figure in figures
+  - time_series(file,site,vname,title,ave,legend)     : monthly time series (plot_single_site.plot_time_series_monthly)
+  - two_var    (file,site,vnames,titles,ave,legend)   : two-variable scatter (plot_single_site.plot_2var)
+  - dvdlnr     (file,site,dv,rec,legend)              : size distribution (plot_single_site_size.plot_dvdlnr)
+
+Used by plot_single_site.render_sites and plot_single_site_size.render_dvdlnr.
+
+'''''
+import os
+import time
+import contextlib
+import datetime
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+
+from .aeronet_size_analysis import size_bins
+
+line_color = 'tab:blue'
+
+# One figure of each size per process, reused: the artists of a figure refer to it
+# and to each other, so a figure per plot would only be freed by the cyclic GC
+shared_figures = {}
+subplot_params = ['left','bottom','right','top','wspace','hspace']
+
+@contextlib.contextmanager
+def new_figure(figsize=None):
+  fig = shared_figures.get(figsize)
+  if fig is None:
+    fig = shared_figures[figsize] = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+  try:
+    yield fig, fig.add_subplot()
+  finally:
+    # Cleared once saved, with the subplot parameters tight_layout changed
+    fig.clear()
+    fig.subplots_adjust(**{k: matplotlib.rcParams['figure.subplot.'+k] for k in subplot_params})
+
+def time_series(file,site,vname,title,ave,legend=True):
+  with new_figure() as (fig, ax):
+    ax.plot(ave.index,ave[vname],'o-',label='AERONET observation')
+    ax.plot(datetime.datetime(2006,12,5),np.mean(ave[vname]),'D',markersize=5,color=line_color)
+
+    if legend:
+      ax.legend()
+    ax.set_xlim([datetime.datetime(2005,12,15),datetime.datetime(2006,12,15)])
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=2))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%b"))
+    ax.set_xlabel('Date')
+    ax.set_ylabel(title)
+    ax.set_title(site)
+    fig.savefig(file)
+
+def two_var(file,site,vnames,titles,ave,legend=True):
+  with new_figure() as (fig, ax):
+    ax.scatter(ave[vnames[0]],ave[vnames[1]],s=60,marker='D',label='AERONET')
+
+    ax.set_xlabel(titles[0])
+    ax.set_ylabel(titles[1])
+    ax.set_title(site)
+    if legend: ax.legend()
+    fig.savefig(file,facecolor='white')
+
+def dvdlnr(file,site,dv,rec,legend=True):
+  with new_figure() as (fig, ax):
+    ax.semilogx(size_bins,dv,'-',linewidth=2,color='k',label='AERONET')
+
+    ax.set_xlabel('Radius [${\\mu m}$]',fontsize=14)
+    ax.set_ylabel('dV(r)/dln(r) [${\\mu m}$]',fontsize=14)
+    ax.set_title('{} (rec={})'.format(site,rec),fontsize=14)
+
+    if legend: ax.legend()
+    ax.tick_params(labelsize=14)
+    fig.tight_layout()
+    fig.savefig(file,facecolor='white')
+
+figures = {'time_series':time_series, 'two_var':two_var, 'dvdlnr':dvdlnr}
+
+def render_job(job):
+  figure, kwargs = job
+  t0 = time.perf_counter()
+  figures[figure](**kwargs)
+  return {'file':kwargs['file'], 'site':kwargs['site'], 'figure':figure,
+          'time_s':time.perf_counter()-t0}
+
+def render_jobs(jobs,n_workers=1):
+  for d in {os.path.dirname(kwargs['file']) for figure, kwargs in jobs}:
+    if d and not os.path.exists(d):
+      os.makedirs(d)
+
+  n_workers = n_workers or os.cpu_count()
+  if n_workers == 1 or len(jobs) < 2:
+    return list(map(render_job,jobs))
+
+  chunksize = max(1, len(jobs)//(n_workers*4))
+  with ProcessPoolExecutor(max_workers=n_workers) as executor:
+    return list(executor.map(render_job,jobs,chunksize=chunksize))
@@ -1,13 +1,13 @@
 import numpy as np
-import pandas as pd
-import os
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import datetime
+from .aeronet_profile import profiled
 
-from pandas.plotting import register_matplotlib_converters
- 
-register_matplotlib_converters()
+def register_converters():
+  # pandas date converters for pyplot, registered when a time series is plotted
+  from pandas.plotting import register_matplotlib_converters
+  register_matplotlib_converters()
 # Output directory
 save_path = 'workspace/MSJ_plot/single_site/'
 
@@ -26,6 +26,7 @@ class plot_single_site():
     self.case_label   = case_label
     self.save_path    = save_path
 
+  @profiled
   def plot_sites(self,sites=['Ascension_Island'],
                         var=['aod'],
                         plot_2var=False,
@@ -35,19 +36,68 @@ class plot_single_site():
                         legend=False,
                         save=None):
 
-    from aeronet_single_site import aeronet_single_site
+    from .aeronet_single_site import aeronet_single_site
+    if plot_time and smooth_window:
+      # Daily values of all sites and their rolling means, computed once (aeronet_timeseries)
+      vnames = [self.aeronet.col_names[vname] for vname in var]
+      series = self.aeronet.daily_series(vnames,sites=list(sites))
+      rolled = {vname: series.rolling(vname,smooth_window) for vname in vnames}
+
     for site_name in sites:
       site = aeronet_single_site(self.aeronet,site_name)
 
-      if plot_time:        
+      if plot_time and smooth_window:
+        self.plot_time_series_daily(site_name,var,series,rolled,smooth_window,save=save,legend=legend)
+      elif plot_time:
         self.plot_time_series_monthly(site_name,var,site,save=save,legend=legend)
 
       if plot_2var:
         self.plot_2var(site_name,var,site,
                       save=save,legend=legend)
 
+  ## Batch: Agg figures rendered in a process pool, returns [{'file','site','figure','time_s'}]
+  @profiled
+  def render_sites(self,sites=['Ascension_Island'],
+                        var=['aod'],
+                        plot_2var=False,
+                        plot_time=True,
+                        legend=False,
+                        n_workers=1):
+
+    from .aeronet_single_site import aeronet_single_site
+    from .batch_plot import render_jobs
+    jobs = []
+    for site_name in sites:
+      site = aeronet_single_site(self.aeronet,site_name)
+      vnames = [self.aeronet.col_names[vname] for vname in var]
+      ave = {vname: site.monthly_average(vname_aeronet) for vname, vname_aeronet in zip(var,vnames)}
+
+      if plot_time:
+        for vname, vname_aeronet in zip(var,vnames):
+          if len(ave[vname]) == 0:
+            print(f'{site_name} ({vname}) is not plotted')
+            continue
+          jobs.append(('time_series',
+                       dict(file=self.save_path+'{}_{}.png'.format(site_name.lower(),vname),
+                            site=site_name, vname=vname_aeronet, title=var_conv['title'][vname],
+                            ave=ave[vname], legend=legend)))
+
+      if plot_2var:
+        aeronet_combined = ave[var[0]].join(ave[var[1]],how='inner')
+        if len(aeronet_combined) == 0:
+          print(f'{site_name} ({var}) is not plotted')
+          continue
+        jobs.append(('two_var',
+                     dict(file=self.save_path+'{}_{}_{}.png'.format(site_name.lower(),var[0],var[1]),
+                          site=site_name, vnames=vnames[:2],
+                          titles=[var_conv['title'][v] for v in var[:2]],
+                          ave=aeronet_combined, legend=legend)))
+
+    return render_jobs(jobs,n_workers=n_workers)
+
+  @profiled
   def plot_time_series_monthly(self,site_name,var,aeronet_data,legend=True,save=False):
-    
+    register_converters()
     for vname in var:
       fig, ax = plt.subplots()
       ## Plot AERONET
@@ -72,6 +122,33 @@ class plot_single_site():
         plt.savefig(fname)
         print('Save fig as {}'.format(fname))
 
+  @profiled
+  def plot_time_series_daily(self,site_name,var,series,rolled,window,legend=True,save=False):
+    register_converters()
+    i = series.sites.get_loc(site_name)
+    for vname in var:
+      vname_aeronet = self.aeronet.col_names[vname]
+      values = series.values[vname_aeronet][i]
+      if np.isnan(values).all():
+        print(f'{site_name} ({vname}) is not plotted')
+        continue
+      fig, ax = plt.subplots()
+      plt.plot(series.dates,values,'.',markersize=3,label='AERONET daily')
+      plt.plot(series.dates,rolled[vname_aeronet][i],'-',color=line_colors['aeronet'],
+               label='{}-day mean'.format(window))
+
+      if legend:
+        plt.legend()
+      ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%b"))
+      plt.xlabel('Date')
+      plt.ylabel(var_conv['title'][vname])
+      plt.title('{}'.format(site_name))
+      if save:
+        fname = self.save_path+'{}_{}_daily.png'.format(site_name.lower(),vname)
+        plt.savefig(fname)
+        print('Save fig as {}'.format(fname))
+
+  @profiled
   def plot_2var(self,site_name,var,aeronet_data,legend=True,save=False):
     fig, ax = plt.subplots()
     # AERONET
@@ -3,6 +3,9 @@ import matplotlib.dates as mdates
 import matplotlib.colors
 import numpy as np
 import pandas as pd
+from .aeronet_size_analysis import size_bins, bin_names, convert, moments, fine_radius_default # Registers df.dvdlnr
+from .aeronet_aggregate import group_stats
+from .aeronet_profile import profiled
 # import seaborn as sns
 
 # sns.set()
@@ -11,35 +14,30 @@ import pandas as pd
 month_dict = {'JAN':1, 'FEB':2, 'MAR':3, 'APR':4, 'MAY':5, 'JUN':6, 
               'JUL':7, 'AUG':8, 'SEP':9, 'OCT':10,'NOV':11, 'DEC':12}
 
-size_bins = [0.05,0.065604, 0.086077, 0.112939, 0.148184,
-             0.194429, 0.255105, 0.334716, 0.439173, 0.576227,
-             0.756052, 0.991996, 1.301571, 1.707757, 2.240702,
-             2.939966, 3.857452, 5.06126, 6.640745, 8.713145,
-             11.432287, 15.0]
-
-bin_names = ['Bin {}'.format(i+1) for i in range(len(size_bins))]
 agg_dict = {'Site_Latitude(Degrees)':'mean',
             'Site_Longitude(Degrees)':'mean',
             'AOD_500nm':['mean','count'],
             '440-870_Angstrom_Exponent':['mean','count']
            }
 
-agg_dict2 = {'dV/dlnr':'count'}
-for bin_name in bin_names:
-    agg_dict2[bin_name] = 'mean'
-
 colors={'Sulfate':'orange','BC':'grey','OC':'hotpink','Salt':'royalblue','Dust':'brown'}
 
 class plot_single_site_size():
 
+    @profiled
     def __init__(self,aeronet):
         self.aeronet = aeronet
-        self.aeronet_size_agg =  (aeronet.df
-                            .groupby(['AERONET_Site_Name'])
-                            .agg({**agg_dict,**agg_dict2})
+        df = aeronet.df
+        # Size bins averaged from the dV/dlnr array (df.dvdlnr)
+        size_agg = pd.concat([df.dvdlnr.mean(df['AERONET_Site_Name']),
+                              df.dvdlnr.count(df['AERONET_Site_Name'])],axis=1)
+        size_agg.columns = pd.MultiIndex.from_tuples([(c,'mean') for c in bin_names] + [('dV/dlnr','count')])
+        self.aeronet_size_agg =  (group_stats(df,agg_dict)
+                            .join(size_agg)
                             .dropna(subset=[('AOD_500nm','mean'),('440-870_Angstrom_Exponent','mean')])
                             .sort_values(by=[('dV/dlnr','count')],ascending=False))
 
+    @profiled
     def plot_dvdlnr(self,site,
                     savedir=None,
                     save_suffix='',
@@ -70,39 +68,68 @@ class plot_single_site_size():
         plt.show()
         return
 
-    # Plot size distribution: Time series
-    def get_dV_data(self,site,time_range=None):
-        data = self.aeronet.df[self.aeronet.df['AERONET_Site_Name']==site]
-
-        if time_range:
-            data = data[data['Date(dd:mm:yyyy)']>time_range[0]]
-            data = data[data['Date(dd:mm:yyyy)']<time_range[1]]
-        data = data.set_index('Date(dd:mm:yyyy)')
-
-        if time_range and data.iloc[0].name != time_range[0]:
-            data.loc[time_range[0]] = np.nan
-        if time_range and data.iloc[-1].name != time_range[1]:
-            data.loc[time_range[1]] = np.nan
-
-        # data = data.resample('D').mean()
+    # Batch: Agg figures rendered in a process pool, returns [{'file','site','figure','time_s'}]
+    @profiled
+    def render_dvdlnr(self,sites,savedir,save_suffix='',legend=True,n_workers=1):
+        from .batch_plot import render_jobs
+        jobs = []
+        for site in sites:
+            if site not in self.aeronet_size_agg.index:
+                print('{}: Site does not contain size data in this period'.format(site))
+                continue
+            row = self.aeronet_size_agg.loc[site]
+            jobs.append(('dvdlnr',
+                         dict(file='{}{}_size_dv{}.png'.format(savedir,site.lower(),save_suffix),
+                              site=site, dv=[row[(bin_name,'mean')] for bin_name in bin_names],
+                              rec=int(row[('dV/dlnr','count')]), legend=legend)))
+
+        return render_jobs(jobs,n_workers=n_workers)
 
-        dV_data = data[bin_names].T
+    # Plot size distribution: Time series
+    @profiled
+    def get_dV_data(self,site,time_range=None,daily=False):
+        if daily:
+            # One column per calendar day, NaN on the days without a record
+            series = self.aeronet.daily_series(bin_names,sites=[site],time_range=time_range)
+            return pd.DataFrame(np.vstack([series.values[b][0] for b in bin_names]),index=bin_names,
+                                columns=series.dates)
+
+        df = self.aeronet.df
+        rows = self.aeronet.site_index().rows(site,time_range)
+        dates = list(df['Date(dd:mm:yyyy)'].iloc[rows])
+        dV = df.iloc[rows].dvdlnr.values
+
+        if time_range and dates[0] != pd.Timestamp(time_range[0]):
+            dates.append(pd.Timestamp(time_range[0]))
+            dV = np.vstack([dV,np.full((1,len(bin_names)),np.nan)])
+        if time_range and dates[-1] != pd.Timestamp(time_range[1]):
+            dates.append(pd.Timestamp(time_range[1]))
+            dV = np.vstack([dV,np.full((1,len(bin_names)),np.nan)])
+
+        dV_data = pd.DataFrame(dV.T,index=bin_names,
+                               columns=pd.Index(dates,name='Date(dd:mm:yyyy)'))
 
         return dV_data
 
-    def dV2dN(self,dV_data):
-        dN_data = pd.DataFrame()
-        for i in range(len(bin_names)):
-            bin_name=bin_names[i]
-            volume = 4/3*np.pi*size_bins[i]**3
-            dN_data[bin_name] = dV_data.T[bin_name].apply(lambda x: x/volume)
+    def dV2dN(self,dV_data,to='dN'):
+        # dV_data: bins x dates
+        dN_data = pd.DataFrame(convert(dV_data.values.T,'dV',to).T,
+                               index=dV_data.index,columns=dV_data.columns)
+
+        return dN_data
 
-        return dN_data.T
+    # Moments of each record (Volume, Reff, VMR, fine/coarse fractions, ...), index of dates
+    @profiled
+    def get_moments(self,site,time_range=None,fine_radius=fine_radius_default):
+        dV_data = self.get_dV_data(site=site,time_range=time_range)
+        return pd.DataFrame(moments(dV_data.values.T,fine_radius=fine_radius),
+                            index=dV_data.columns)
 
+    @profiled
     def plot_dV_time(self,site,time_range=None,
-                        vmin=2e-2, vmax=1e1):
+                        vmin=2e-2, vmax=1e1, daily=False):
 
-        dV_data = self.get_dV_data(site=site,time_range=time_range)
+        dV_data = self.get_dV_data(site=site,time_range=time_range,daily=daily)
 
         # Plot
         date_list=list(dV_data.columns)
@@ -125,10 +152,11 @@ class plot_single_site_size():
         ax.set_title('dV/dlnr',fontsize=16)
         return
 
+    @profiled
     def plot_dN_time(self,site='Solar_Village',time_range=None,all_dates=True,
-                    vmin=2e-2, vmax=1e2):
+                    vmin=2e-2, vmax=1e2, daily=False):
 
-        dV_data = self.get_dV_data(site=site,time_range=time_range)
+        dV_data = self.get_dV_data(site=site,time_range=time_range,daily=daily)
         dN_data = self.dV2dN(dV_data)
 
         # Plot
@@ -0,0 +1,22 @@
+import gc
+import weakref
+import numpy as np
+
+from aerosol_obs_analysis import batch_plot
+from aerosol_obs_analysis.aeronet_size_analysis import size_bins
+
+def test_figure_reused_and_cleared(tmp_path):
+  dv = np.ones(len(size_bins))
+  batch_plot.dvdlnr(str(tmp_path/'d0.png'),'site',dv,3)
+  fig = weakref.ref(batch_plot.shared_figures[None])
+
+  # No new figure is left for the cyclic GC, the shared one is empty between plots
+  gc.disable()
+  try:
+    for i in range(3):
+      batch_plot.dvdlnr(str(tmp_path/'d{}.png'.format(i)),'site',dv,3)
+      assert batch_plot.shared_figures[None] is fig()
+      assert fig().axes == []
+  finally:
+    gc.enable()
+  assert (tmp_path/'d2.png').stat().st_size > 0
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from aerosol_obs_analysis import aeronet
+
+def site_table():
+  dates = pd.date_range('2010-01-01','2010-02-28',freq='D')
+  return pd.DataFrame({'AERONET_Site_Name'     : np.repeat(['A','B'],len(dates)),
+                       'Date(dd:mm:yyyy)'      : np.tile(dates,2),
+                       'Site_Latitude(Degrees)': np.repeat([10.,20.],len(dates)),
+                       'Site_Longitude(Degrees)': np.repeat([30.,40.],len(dates)),
+                       'Day_of_Year'           : np.tile(dates.dayofyear,2),
+                       'AOD_500nm'             : np.linspace(0.1,0.5,2*len(dates))})
+
+def test_hits_are_copies():
+  data = aeronet(pickle_path='./')
+  data.df = site_table()
+
+  series = data.daily_series()
+  series.values['AOD_500nm'][:] = -1
+  assert (data.daily_series().values['AOD_500nm'] > 0).all()
+
+  cube = data.grid_cube(grid=5.0)
+  cube.stats['AOD_500nm']['mean'][:] = -1
+  assert (data.grid_cube(grid=5.0).stats['AOD_500nm']['mean'] > 0).all()
+
+  ave = data.cal_average()
+  ave['AOD_500nm'] = -1
+  assert (data.cal_average()['AOD_500nm'] > 0).all()
+  assert data.cache_stats()['hits'] == 3
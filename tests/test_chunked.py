@@ -0,0 +1,68 @@
+import os
+import tracemalloc
+import numpy as np
+import pytest
+import pandas as pd
+
+from aerosol_obs_analysis import aeronet
+from aerosol_obs_analysis.aeronet_synthetic import write_synthetic
+from aerosol_obs_analysis.aeronet_chunked import plan_batches
+
+def chunked_peak(data,data_name,file_path,max_memory_mb):
+  # tracemalloc sees the Python heap (numpy and pandas arrays included) only, the buffers
+  # of the pandas C parser and of pyarrow are not counted: this bounds the heap, not the RSS
+  tracemalloc.start()
+  try:
+    ave = data.extract_daily_chunked(data_name,file_path,max_memory_mb=max_memory_mb)
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return ave, peak/1e6
+
+def test_peak_memory_within_budget(tmp_path):
+  paths = write_synthetic(str(tmp_path/'raw'),n_sites=40,n_years=2,seed=3)
+  data = aeronet(pickle_path=str(tmp_path/'ws')+'/',cache_mb=0)
+
+  for data_name, max_memory_mb in [('INV',3),('AOD',2)]:
+    files = [paths[data_name]+f for f in sorted(os.listdir(paths[data_name]))]
+    assert len(plan_batches(files,max_memory_mb)) > 1
+    # Untraced first run: the budget is for the batches, not the one-time
+    # allocations of the first call (pyarrow import, pandas/pyarrow caches)
+    data.extract_daily_chunked(data_name,paths[data_name],max_memory_mb=max_memory_mb)
+    ave, peak_mb = chunked_peak(data,data_name,paths[data_name],max_memory_mb)
+    assert len(ave) == 40
+    assert peak_mb <= max_memory_mb, '{} peak {:.2f} MB above {} MB'.format(data_name,peak_mb,max_memory_mb)
+
+def test_time_range_keeps_all_sites_store(tmp_path):
+  paths = write_synthetic(str(tmp_path/'raw'),n_sites=4,n_years=2,seed=5)
+  ws = str(tmp_path/'ws')+'/'
+  data = aeronet(pickle_path=ws)
+  data.extract_daily_chunked('AOD',paths['AOD'],max_memory_mb=0.1)
+  n_all = len(pd.read_parquet(ws+'AOD20_daily_all_sites.parquet'))
+
+  time_range = [pd.Timestamp('2005-01-01'),pd.Timestamp('2005-03-01')]
+  data.extract_daily_chunked('AOD',paths['AOD'],max_memory_mb=0.1,time_range=time_range)
+
+  assert len(pd.read_parquet(ws+'AOD20_daily_all_sites.parquet')) == n_all
+  assert 0 < len(pd.read_parquet(ws+'AOD20_daily_chunked_20050101_20050301.parquet')) < n_all
+  with pytest.raises(ValueError):
+    data.extract_daily_chunked('AOD',paths['AOD'],store_name='AOD20_daily_all_sites.parquet',
+                               time_range=time_range)
+
+def test_batches_leave_df_untouched(tmp_path):
+  paths = write_synthetic(str(tmp_path/'raw'),n_sites=6,n_years=1,seed=4)
+  data = aeronet(pickle_path=str(tmp_path/'ws')+'/')
+  df = pd.DataFrame({'AERONET_Site_Name':['A'],'Date(dd:mm:yyyy)':[pd.Timestamp('2005-01-01')]})
+  data.df = df
+  version = data._df_version
+  data.cached('probe',[],lambda: 1)
+
+  ave = data.extract_daily_chunked('AOD',paths['AOD'],max_memory_mb=0.1)
+
+  assert data.df is df
+  assert data._df_version == version
+  assert data.cache_stats()['entries'] == 1
+  # Same averages as the whole table at once
+  data.load_store('AOD20_daily_all_sites.parquet')
+  whole = data.cal_average(['AOD_500nm'])
+  assert np.allclose(ave['AOD_500nm'].sort_index(),whole['AOD_500nm'].sort_index())
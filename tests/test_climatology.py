@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from aerosol_obs_analysis import aeronet
+
+def test_monthly_cube_columns():
+  dates = pd.date_range('2010-01-01','2010-03-31',freq='D')
+  data = aeronet(pickle_path='./')
+  data.df = pd.DataFrame({'AERONET_Site_Name': 'A',
+                          'Date(dd:mm:yyyy)' : dates,
+                          'AOD_500nm'        : np.linspace(0.1,0.5,len(dates)),
+                          '440-870_Angstrom_Exponent': 1.2})
+
+  cube = data.monthly_cube(['AOD_500nm'])
+  assert data.monthly_cube(['AOD_500nm']) is cube
+  assert cube.variables() == ['AOD_500nm']
+
+  cube = data.monthly_cube(['440-870_Angstrom_Exponent'])
+  assert cube.variables() == ['AOD_500nm','440-870_Angstrom_Exponent']
+  assert list(cube.stats('A','440-870_Angstrom_Exponent')['count']) == [31,28,31]
+  assert np.isclose(cube.monthly('A','AOD_500nm').iloc[0,0],data.df['AOD_500nm'][:31].mean())
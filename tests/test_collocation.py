@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from aerosol_obs_analysis.aeronet_collocation import model_field, collocation
+
+site_col = 'AERONET_Site_Name'
+date_col = 'Date(dd:mm:yyyy)'
+lat_col  = 'Site_Latitude(Degrees)'
+lon_col  = 'Site_Longitude(Degrees)'
+
+def linear_field(lat,lon,days=2):
+  # Values linear in lat and lon (in the grid's own longitudes), + 1000 per day
+  time = pd.date_range('2010-01-01',periods=days,freq='D')
+  values = (1000*np.arange(days)[:,None,None] + 10*np.asarray(lat,dtype=float)[None,:,None]
+            + np.asarray(lon,dtype=float)[None,None,:])
+  return model_field(values,lat,lon,time)
+
+def site_table(coords):
+  return pd.DataFrame({lat_col:[c[1] for c in coords.values()],
+                       lon_col:[c[2] for c in coords.values()]},
+                      index=pd.Index([c[0] for c in coords.values()],name=site_col))
+
+def model_values(field,coords,method,day='2010-01-02'):
+  sites = site_table(coords)
+  df = pd.DataFrame({site_col : sites.index,
+                     date_col : pd.Timestamp(day),
+                     'AOD_500nm': 0.1})
+  pairs = collocation(field,sites,method).pairs(df)
+  return pairs.set_index(site_col)['model'].reindex(sites.index)
+
+def test_nearest():
+  field = linear_field(lat=[0,10,20],lon=[100,110,120])
+  model = model_values(field,{1:('a',1,101),2:('b',14,118),3:('c',6,104)},'nearest')
+  assert np.allclose(model.values,[1000+0+100,1000+100+120,1000+100+100])
+
+def test_bilinear():
+  field = linear_field(lat=[0,10,20],lon=[100,110,120])
+  model = model_values(field,{1:('a',2.5,103),2:('b',15,112)},'bilinear')
+  assert np.allclose(model.values,[1000+25+103,1000+150+112])
+
+def test_regional_grid_edges():
+  # Descending latitudes and longitudes; sites within half a cell outside take the edge cell,
+  # sites further out get no model value
+  field = linear_field(lat=[20,10,0],lon=[120,110,100])
+  coords = {1:('west',5,99.7),2:('east',5,124),3:('far_west',5,90),4:('far_east',5,130),
+            5:('south',-4,110)}
+  for method in ['nearest','bilinear']:
+    model = model_values(field,coords,method)
+    expected = 1000+50+100 if method == 'bilinear' else 1000+100+100
+    assert np.isclose(model['west'],expected), method
+    assert np.isclose(model['east'],1000+(50 if method == 'bilinear' else 100)+120), method
+    assert model[['far_west','far_east']].isna().all(), method
+    assert np.isclose(model['south'],1000+0+110), method
+
+def test_periodic_global_grid():
+  # 0..350 in 10 degree cells: a site at -2 (358E) lies between the 350 and 0 cells
+  lon = np.arange(0,360,10)
+  field = linear_field(lat=[-5,5],lon=lon)
+  coords = {1:('dateline',-5,-2),2:('greenwich',5,1)}
+  nearest = model_values(field,coords,'nearest')
+  assert np.allclose(nearest.values,[1000-50+0,1000+50+0])
+  bilinear = model_values(field,coords,'bilinear')
+  # Weights 0.2 on the 350 cell and 0.8 on the 0 cell (values in the grid's longitudes)
+  assert np.isclose(bilinear['dateline'],1000-50+0.2*350)
+  assert np.isclose(bilinear['greenwich'],1000+50+0.1*10)
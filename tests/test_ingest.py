@@ -0,0 +1,69 @@
+import glob
+import numpy as np
+
+from aerosol_obs_analysis import analysis_utils
+from aerosol_obs_analysis.aeronet_synthetic import write_synthetic
+
+def inv_file(root):
+  write_synthetic(str(root),n_sites=1,n_years=1,seed=1)
+  return sorted(glob.glob(str(root)+'/INV/LEV20/ALL/DAILY/*'))[0]
+
+def test_text_columns_from_first_row(tmp_path):
+  df = analysis_utils.read_daily_file(inv_file(tmp_path))
+  assert df['Last_Processing_Time(hh:mm:ss)'].dtype == object
+  assert df['Retrieval_Measurement_Scan-Type'].dtype == object
+  assert df['AOD_Extinction-Total[440nm]'].dtype == np.float32
+  assert df['Day_of_Year'].dtype == np.int32
+
+def test_text_further_down_a_column(tmp_path):
+  filename = inv_file(tmp_path)
+  df = analysis_utils.read_daily_file(filename)
+
+  lines = open(filename).read().split('\n')
+  column = 'AOD_Extinction-Total[440nm]'
+  j = lines[6].split(',').index(column)
+  row = lines[9].split(',')
+  row[j] = 'cloudy'
+  lines[9] = ','.join(row)
+  bad = tmp_path/'bad.all'
+  bad.write_text('\n'.join(lines))
+
+  # Only the column with text is read as str, the others keep the schema
+  df_bad = analysis_utils.read_daily_file(str(bad))
+  assert df_bad[column].dtype == object
+  others = [c for c in df.columns if c != column]
+  assert (df_bad[others].dtypes == df[others].dtypes).all()
+  assert df_bad[others].equals(df[others])
+
+def test_in_memory_file(tmp_path):
+  import io
+  filename = inv_file(tmp_path)
+  with open(filename,'rb') as f:
+    df = analysis_utils.read_daily_file(io.BytesIO(f.read()))
+  assert df.equals(analysis_utils.read_daily_file(filename))
+
+def test_tar_members_read_ahead_bounded(tmp_path,monkeypatch):
+  import tarfile
+  import concurrent.futures
+
+  paths = write_synthetic(str(tmp_path/'raw'),n_sites=8,n_years=1,seed=2)
+  tarname = str(tmp_path/'aod.tar.gz')
+  with tarfile.open(tarname,'w:gz') as tar:
+    tar.add(paths['AOD'],arcname='AOD')
+
+  # Largest number of members submitted and not yet parsed
+  counts = {'pending':0, 'max':0}
+  class counting_executor(concurrent.futures.ProcessPoolExecutor):
+    def submit(self,*args,**kwargs):
+      counts['pending'] += 1
+      counts['max'] = max(counts['max'],counts['pending'])
+      future = super().submit(*args,**kwargs)
+      future.add_done_callback(lambda f: counts.update(pending=counts['pending']-1))
+      return future
+  monkeypatch.setattr(concurrent.futures,'ProcessPoolExecutor',counting_executor)
+
+  serial = analysis_utils.read_daily_tar(tarname,'AOD/',n_workers=1)
+  pooled = analysis_utils.read_daily_tar(tarname,'AOD/',n_workers=2,in_flight=1)
+  assert len(serial) == 8
+  assert all([a.equals(b) for a, b in zip(serial,pooled)])
+  assert counts['max'] <= 2
@@ -0,0 +1,20 @@
+import pytest
+
+from aerosol_obs_analysis.aeronet_pipeline import aeronet_pipeline
+from aerosol_obs_analysis.aeronet_synthetic import write_synthetic
+
+def test_unknown_site_raises(tmp_path):
+  paths = write_synthetic(str(tmp_path/'raw'),n_sites=3,n_years=1,seed=6)
+  ws = str(tmp_path/'ws')+'/'
+  config = {'pickle_path':ws, 'aod':{'raw':paths['AOD']}, 'site':'Typo_Site', 'save':'site.parquet'}
+  with pytest.raises(KeyError):
+    aeronet_pipeline(config).run()
+  assert not (tmp_path/'ws'/'site.parquet').exists()
+
+  data = aeronet_pipeline({**config,'site':'Synthetic_0001'}).run()
+  assert len(data.df) > 0
+  assert set(data.df['AERONET_Site_Name']) == {'Synthetic_0001'}
+
+def test_config_without_source(tmp_path):
+  with pytest.raises(ValueError):
+    aeronet_pipeline({'pickle_path':str(tmp_path)+'/'})
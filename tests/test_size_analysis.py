@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from aerosol_obs_analysis.aeronet_size_analysis import bin_names
+
+def size_frame(n=5):
+  rng = np.random.default_rng(0)
+  return pd.DataFrame(rng.random((n,len(bin_names))).astype(np.float32),columns=bin_names)
+
+def test_values_follow_the_bin_columns():
+  df = size_frame()
+  assert np.array_equal(df.dvdlnr.values,df[bin_names].to_numpy())
+  df['Bin 1'] = 0.0
+  assert (df.dvdlnr.values[:,0] == 0).all()
+
+def test_no_copy_kept_on_the_frame():
+  df = size_frame()
+  df.dvdlnr.values
+  assert not any(isinstance(v,np.ndarray) for v in vars(df.dvdlnr).values())
+
+def test_values_view_of_the_bin_block():
+  df = size_frame()
+  values = df.dvdlnr.values
+  assert np.shares_memory(values,df['Bin 3'].to_numpy())
+  assert not values.flags.writeable
+
+  copy = df.dvdlnr.to_numpy(copy=True)
+  assert copy.flags.writeable and not np.shares_memory(copy,df['Bin 3'].to_numpy())
+  assert np.array_equal(copy,values)